@@ -0,0 +1,164 @@
+"""Admission control for api requests.
+
+Each client (identified by its X-User header) gets a token bucket that limits its request rate, and each class of
+route gets its own concurrency limit, so that a client hammering expensive listings can't starve cheap single-asset
+lookups. Requests over a limit are rejected quickly with a 429 and a Retry-After header.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, Response
+
+from asset_store.metrics import metrics
+
+# route classes with separate concurrency limits
+EXPENSIVE = 'expensive'
+CHEAP = 'cheap'
+
+
+class TokenBucket(object):
+    """Allow bursts of up to burst requests, refilled at rate requests per second."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now):
+        """Take a token if one is available.
+
+        Returns:
+            retry_after (float): 0 if a token was taken, otherwise seconds until one will be available
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        if self.rate <= 0:
+            return float('inf')
+        return (1 - self.tokens) / self.rate
+
+
+class InMemoryBackend(object):
+    """Per-client token buckets held in this process.
+
+    Only the most recently seen max_clients buckets are kept; a client whose bucket was dropped starts over with a
+    full bucket.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000, clock=time.time):
+        """Create an empty backend."""
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, client):
+        """Take a token from client's bucket, returning 0 or the seconds to wait (see TokenBucket.take)."""
+        with self._lock:
+            now = self.clock()
+            bucket = self._buckets.pop(client, None)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst, now)
+            # re-insert to mark as most recently seen
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return bucket.take(now)
+
+
+class ConcurrencyLimiter(object):
+    """Limit how many requests run at once, briefly queueing requests that arrive while it is full."""
+
+    def __init__(self, limit, queue_timeout=0.05):
+        """Allow limit concurrent requests; others wait up to queue_timeout seconds for a slot."""
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    def acquire(self):
+        """Take a slot, returning False if none became free in time."""
+        if self._semaphore.acquire(False):
+            return True
+        metrics.incr('admission.queued')
+        return self._semaphore.acquire(timeout=self.queue_timeout)
+
+    def release(self):
+        """Give back a slot."""
+        self._semaphore.release()
+
+
+class AdmissionController(object):
+    """Decide whether to admit requests, by client rate and by route class concurrency."""
+
+    def __init__(self, backend, limiters):
+        """Create a controller.
+
+        Args:
+            backend (InMemoryBackend): per-client rate limits
+            limiters (dict): a ConcurrencyLimiter for each route class that has a concurrency limit
+        """
+        self.backend = backend
+        self.limiters = limiters
+
+
+def _too_many_requests(message, retry_after):
+    seconds = int(math.ceil(retry_after)) if retry_after != float('inf') else 60
+    return {'message': message}, 429, {'Retry-After': str(max(seconds, 1))}
+
+
+def admission_controlled(route_class):
+    """Decorate a resource method to apply admission control for a class of route (EXPENSIVE or CHEAP)."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            controller = current_app.extensions.get('admission')
+            if controller is None:
+                return func(*args, **kwargs)
+
+            client = request.headers.get('X-User') or request.remote_addr
+            retry_after = controller.backend.take(client)
+            if retry_after:
+                metrics.incr('admission.rejected')
+                metrics.incr('admission.rejected.rate_limited')
+                return _too_many_requests('Rate limit exceeded.', retry_after)
+
+            limiter = controller.limiters.get(route_class)
+            if limiter is None:
+                return func(*args, **kwargs)
+            if not limiter.acquire():
+                metrics.incr('admission.rejected')
+                metrics.incr('admission.rejected.{}'.format(route_class))
+                return _too_many_requests('Too many concurrent requests.', 1)
+            try:
+                response = func(*args, **kwargs)
+            except Exception:
+                limiter.release()
+                raise
+            if isinstance(response, Response) and response.is_streamed:
+                # the body is rendered (and compressed) as it is sent, so hold the slot until the server closes it
+                response.call_on_close(limiter.release)
+            else:
+                limiter.release()
+            return response
+        return wrapper
+    return decorator
+
+
+def init_admission_control(app):
+    """Turn on admission control for app if ADMISSION_CONTROL is enabled in its config."""
+    if not app.config.get('ADMISSION_CONTROL'):
+        return None
+    backend = InMemoryBackend(app.config['RATE_LIMIT_PER_SECOND'], app.config['RATE_LIMIT_BURST'])
+    limiters = dict((route_class, ConcurrencyLimiter(limit, queue_timeout=app.config['ADMISSION_QUEUE_TIMEOUT']))
+                    for route_class, limit in app.config['CONCURRENCY_LIMITS'].items())
+    controller = AdmissionController(backend, limiters)
+    app.extensions['admission'] = controller
+    return controller
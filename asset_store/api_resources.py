@@ -2,18 +2,24 @@
 import json
 import six
 
-from flask import request
+from flask import current_app, request, Response
 from flask_restplus import abort, Api, Resource
-from sqlalchemy.orm.exc import NoResultFound
 
+from asset_store.admission import admission_controlled, CHEAP, EXPENSIVE
 from asset_store.api_serializers import (asset_parser,
                                          asset_details_parser,
                                          asset_filters_parser,
                                          ASSET_FIELDS_TO_SERIALIZE,
                                          ASSET_DETAILS_FIELDS_TO_SERIALIZE)
 
-from asset_store.models import Asset, db
-from asset_store.utils import has_admin_access, remove_nulls, ResourceConflictError, ValidationError
+from asset_store.coalescing import SingleFlight
+from asset_store.documents import DOCUMENT_COLUMNS, row_document
+from asset_store.metrics import metrics
+from asset_store.models import Asset, db, register_write_listener
+from asset_store.partitioning import get_partitioned_store
+from asset_store.shared_cache import get_shared_cache
+from asset_store.utils import (has_admin_access, remove_nulls, ResourceConflictError, ValidationError,
+                               WriteTimeoutError)
 
 # the api is implemented with flask-restplus, which comes with some swaggerific tools for easy auto-documentations
 api = Api(version='0.2.2', title='Asset Store API.',
@@ -24,25 +30,98 @@ api = Api(version='0.2.2', title='Asset Store API.',
 ASSET_RESOURCE_FIELDS = api.model('Asset', ASSET_FIELDS_TO_SERIALIZE)
 ASSET_DETAILS_RESOURCE_FIELDS = api.model('AssetDetails', ASSET_DETAILS_FIELDS_TO_SERIALIZE)
 
+# concurrent identical reads share one db fetch and one serialized payload.
+# any write to an asset stops later requests from joining reads that started before it.
+read_coalescer = SingleFlight('coalescing')
+register_write_listener(read_coalescer.invalidate)
+
+
+def _find_asset(asset_name):
+    """Get an asset by name, or None if there is no such asset."""
+    store = get_partitioned_store(current_app)
+    if store is not None:
+        return store.find_asset(asset_name)
+    return db.session.query(Asset).filter(Asset.asset_name == asset_name).one_or_none()
+
+
+def _load_asset_document(asset_name):
+    """Load the json document of a single asset from its database, or None if there is no such asset."""
+    store = get_partitioned_store(current_app)
+    if store is not None:
+        return store.get_document(asset_name)
+    row = db.session.query(*DOCUMENT_COLUMNS).filter(Asset.asset_name == asset_name).one_or_none()
+    return None if row is None else row_document(row)
+
+
+def _fetch_asset_document(asset_name):
+    """Load the stored json document of a single asset, or None if there is no such asset.
+
+    Documents are read through the shared cache when one is configured.
+    """
+    shared_cache = get_shared_cache(current_app)
+    if shared_cache is None:
+        return _load_asset_document(asset_name)
+
+    version, document = shared_cache.get(asset_name)
+    if document is None:
+        document = _load_asset_document(asset_name)
+        if document is not None:
+            shared_cache.set(asset_name, version, document)
+    return document
+
+
+def _fetch_asset_details(asset_name):
+    """Load the details of a single asset, or None if there is no such asset."""
+    asset = _find_asset(asset_name)
+    if asset is None:
+        return None
+    return asset.asset_details
+
+
+def _fetch_asset_documents(filters):
+    """Load the json documents of all assets matching filters."""
+    store = get_partitioned_store(current_app)
+    if store is not None:
+        return store.list_documents(filters)
+    return [row_document(row) for row in db.session.query(*DOCUMENT_COLUMNS).filter_by(**filters)]
+
+
+# how many documents of a listing are joined per streamed chunk
+LIST_CHUNK_SIZE = 100
+
+
+def _stream_json_list(documents):
+    """Join json documents into a json array a chunk at a time.
+
+    Large listings are sent as a stream so that they can be compressed as they are joined rather than being
+    concatenated into one big string first.
+    """
+    yield '['
+    for start in range(0, len(documents), LIST_CHUNK_SIZE):
+        chunk = ','.join(documents[start:start + LIST_CHUNK_SIZE])
+        yield chunk if start == 0 else ',' + chunk
+    yield ']\n'
+
 
 @api.doc(params={'asset_name': 'unique name of the asset'})
 @api.route('/assets/<asset_name>')
 class AssetResource(Resource):
     """A single asset resource."""
 
-    @api.marshal_with(ASSET_RESOURCE_FIELDS)
-    @api.response(200, 'Success')
+    @api.response(200, 'Success', ASSET_RESOURCE_FIELDS)
     @api.response(400, 'ValidationError')
     @api.response(404, 'Asset Not Found')
+    @api.response(429, 'Too Many Requests')
+    @admission_controlled(CHEAP)
     def get(self, asset_name=None):
         """Get a single Asset."""
         if not isinstance(asset_name, six.string_types):
             abort(400, message='asset_name must be a string.')
-        try:
-            asset = db.session.query(Asset).filter(Asset.asset_name == asset_name).one()
-            return asset, 200
-        except NoResultFound:
+        document = read_coalescer.do(('asset', asset_name), lambda: _fetch_asset_document(asset_name),
+                                     asset_name=asset_name)
+        if document is None:
             abort(404, message='asset with name {} not found.'.format(asset_name))
+        return Response(document, mimetype='application/json')
 
 
 @api.response(200, 'Success')
@@ -54,18 +133,27 @@ class AssetDetailsResource(Resource):
         """Get an asset by name."""
         if not isinstance(asset_name, six.string_types):
             abort(400, message='asset_name must be a string.')
-        try:
-            asset = db.session.query(Asset).filter(Asset.asset_name == asset_name).one()
-        except NoResultFound:
+        asset = _find_asset(asset_name)
+        if asset is None:
             abort(404, message='asset with name {} not found.'.format(asset_name))
         return asset
 
+    @api.response(429, 'Too Many Requests')
+    @admission_controlled(CHEAP)
     def get(self, asset_name=None):
         """Get details for a single Asset."""
-        asset = self._get_asset(asset_name)
-        return asset.asset_details, 200
+        if not isinstance(asset_name, six.string_types):
+            abort(400, message='asset_name must be a string.')
+        asset_details = read_coalescer.do(('details', asset_name), lambda: _fetch_asset_details(asset_name),
+                                          asset_name=asset_name)
+        if asset_details is None:
+            abort(404, message='asset with name {} not found.'.format(asset_name))
+        return asset_details, 200
 
     @api.expect(ASSET_DETAILS_RESOURCE_FIELDS)
+    @api.response(429, 'Too Many Requests')
+    @api.response(503, 'Write Timed Out')
+    @admission_controlled(CHEAP)
     def put(self, asset_name):
         """Update details for a single Asset.
 
@@ -83,6 +171,8 @@ class AssetDetailsResource(Resource):
             asset.update_details(asset_details)
         except ValidationError as err:
             abort(400, message='{}'.format(err))
+        except WriteTimeoutError as err:
+            abort(503, message='{}'.format(err))
         return asset.asset_details, 201
 
 
@@ -92,19 +182,24 @@ class AssetListResource(Resource):
 
     @api.doc(params={'asset_class': 'optional filter for asset_class',
                      'asset_type': 'optional filter for asset_type'})
-    @api.marshal_with(ASSET_RESOURCE_FIELDS, as_list=True)
-    @api.response(200, 'Success')
+    @api.response(200, 'Success', [ASSET_RESOURCE_FIELDS])
+    @api.response(429, 'Too Many Requests')
+    @admission_controlled(EXPENSIVE)
     def get(self):
         """Get a list of assets."""
         filters = remove_nulls(asset_filters_parser.parse_args())
-        assets = db.session.query(Asset).filter_by(**filters).all()
-        return assets, 200
+        key = ('list', tuple(sorted(filters.items())))
+        documents = read_coalescer.do(key, lambda: _fetch_asset_documents(filters))
+        return Response(_stream_json_list(documents), mimetype='application/json')
 
     @api.expect(ASSET_RESOURCE_FIELDS)
     @api.header('X-User', 'just a username for now', required=True)
     @api.response(201, 'Asset Created')
     @api.response(400, 'ValidationError')
     @api.response(403, 'Not Authorized')
+    @api.response(429, 'Too Many Requests')
+    @api.response(503, 'Write Timed Out')
+    @admission_controlled(CHEAP)
     def post(self):
         """Create a new asset."""
         # check if user is authorized
@@ -126,3 +221,15 @@ class AssetListResource(Resource):
             abort(400, message='{}'.format(err))
         except ResourceConflictError as err:
             abort(409, message='{}'.format(err))
+        except WriteTimeoutError as err:
+            abort(503, message='{}'.format(err))
+
+
+@api.route('/metrics')
+class MetricsResource(Resource):
+    """Counters for monitoring the asset store."""
+
+    @api.response(200, 'Success')
+    def get(self):
+        """Get the current value of every counter."""
+        return metrics.snapshot(), 200
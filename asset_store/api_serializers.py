@@ -1,7 +1,8 @@
 """RequestParsers and api models for serialization."""
+import json
 
 from flask_restplus import fields, reqparse
-from asset_store.utils import PartialDictField
+from asset_store.utils import PartialDictField, remove_nulls
 
 # a parser for assets
 asset_parser = reqparse.RequestParser()
@@ -31,3 +32,19 @@ ASSET_FIELDS_TO_SERIALIZE = {'asset_name': fields.String(default='HelloWorld'),
 ASSET_DETAILS_FIELDS_TO_SERIALIZE = {'gain': fields.Float(),
                                      'diameter': fields.Float(),
                                      'radome': fields.Boolean()}
+
+
+def canonical_json(data):
+    """Dump data as compact json with sorted keys, so equal data always gives equal documents."""
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def render_asset_json(asset_name, asset_type, asset_class, asset_details):
+    """Render the json document served for an asset.
+
+    This must produce the same document as marshalling an Asset with ASSET_FIELDS_TO_SERIALIZE.
+    """
+    return canonical_json({'asset_name': asset_name,
+                           'asset_type': asset_type,
+                           'asset_class': asset_class,
+                           'asset_details': remove_nulls(asset_details)})
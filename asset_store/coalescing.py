@@ -0,0 +1,82 @@
+"""Single-flight coalescing of concurrent identical reads."""
+import threading
+
+from asset_store.metrics import metrics
+
+
+class _Flight(object):
+    """A call that is currently in flight, shared by its leader and any followers."""
+
+    def __init__(self, asset_name):
+        self.asset_name = asset_name
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Share one in-flight call between concurrent callers asking for the same key.
+
+    The first caller for a key (the leader) runs the fetch; callers that arrive while it is
+    still running (followers) wait for it and get the same result (or the same exception).
+    Nothing is cached once the leader finishes -- this only deduplicates concurrent work.
+    """
+
+    def __init__(self, name='coalescing'):
+        """Create a group whose counters are prefixed with name."""
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fetch, asset_name=None):
+        """Run fetch() for key, or wait for an identical call that is already in flight.
+
+        Args:
+            key (hashable): identifies identical requests (e.g. route, asset_name and filters)
+            fetch (callable): produces the result; only called by the leader
+            asset_name (string): the asset the result depends on. None means the result depends
+                                 on every asset (e.g. a listing).
+        Returns:
+            the result of fetch(), shared with every coalesced caller
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(asset_name)
+                self._flights[key] = flight
+
+        if not leader:
+            metrics.incr('{}.coalesced'.format(self.name))
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        metrics.incr('{}.executed'.format(self.name))
+        try:
+            flight.result = fetch()
+            return flight.result
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                # a write may already have detached this flight
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def invalidate(self, asset_name):
+        """Stop sharing in-flight results that a write to asset_name may have made stale.
+
+        Callers already waiting on a detached flight still get its result, but any request
+        arriving after the write starts a fresh fetch.
+        """
+        with self._lock:
+            stale = [key for key, flight in self._flights.items()
+                     if flight.asset_name is None or flight.asset_name == asset_name]
+            for key in stale:
+                del self._flights[key]
+        if stale:
+            metrics.incr('{}.invalidated'.format(self.name), len(stale))
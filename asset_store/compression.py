@@ -0,0 +1,109 @@
+"""Content-negotiated gzip/deflate compression of api responses."""
+import zlib
+
+from werkzeug.wsgi import ClosingIterator
+
+# encodings we can produce, in order of preference, with the zlib wbits that produce them
+ENCODINGS = (('gzip', 16 + zlib.MAX_WBITS),
+             ('deflate', zlib.MAX_WBITS))
+
+# only bother compressing content types that are text-like
+COMPRESSIBLE_CONTENT_TYPES = ('application/json', 'application/javascript', 'text/')
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the best supported content-coding from an Accept-Encoding header.
+
+    Args:
+        accept_encoding (string): value of the request's Accept-Encoding header, e.g. 'gzip;q=0.8, deflate'
+    Returns:
+        encoding (string): 'gzip' or 'deflate', or None if the client accepts neither
+    """
+    qualities = {}
+    for part in accept_encoding.split(','):
+        params = part.strip().split(';')
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+
+    best, best_quality = None, 0.0
+    for coding, _ in ENCODINGS:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class CompressionMiddleware(object):
+    """WSGI middleware that compresses responses for clients that accept gzip or deflate.
+
+    Responses with a known Content-Length below min_size are passed through untouched. Responses without a
+    Content-Length (i.e. streamed) are compressed chunk by chunk as the app produces them, so they are never
+    buffered in full.
+    """
+
+    def __init__(self, app, min_size=1024, level=6):
+        """Wrap a WSGI app.
+
+        Args:
+            app (callable): the WSGI app to wrap
+            min_size (int): smallest Content-Length (in bytes) worth compressing
+            level (int): zlib compression level, 1 (fastest) to 9 (smallest)
+        """
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        """Call the wrapped app, compressing its response if the client and response allow it."""
+        encoding = negotiate_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+
+        compress = []
+
+        def compressing_start_response(status, headers, exc_info=None):
+            if self._should_compress(status, headers):
+                compress.append(True)
+                vary = [value for name, value in headers if name.lower() == 'vary']
+                headers = [(name, value) for name, value in headers if name.lower() not in ('content-length', 'vary')]
+                headers.append(('Content-Encoding', encoding))
+                headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.app(environ, compressing_start_response)
+        if not compress:
+            return app_iter
+        # the server may close the body before reading any of it (e.g. when the client disconnects), which never
+        # runs a generator's cleanup, so close the wrapped body from the returned iterable's own close()
+        return ClosingIterator(self._compress(app_iter, dict(ENCODINGS)[encoding]), getattr(app_iter, 'close', None))
+
+    def _should_compress(self, status, headers):
+        code = int(status.split(' ', 1)[0])
+        if code < 200 or code in (204, 304):
+            return False
+        headers = dict((name.lower(), value) for name, value in headers)
+        if 'content-encoding' in headers:
+            return False
+        if not headers.get('content-type', '').startswith(COMPRESSIBLE_CONTENT_TYPES):
+            return False
+        content_length = headers.get('content-length')
+        return content_length is None or int(content_length) >= self.min_size
+
+    def _compress(self, app_iter, wbits):
+        """Compress the chunks of app_iter incrementally."""
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, wbits)
+        for chunk in app_iter:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
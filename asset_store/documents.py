@@ -0,0 +1,146 @@
+"""Maintenance of the pre-rendered json documents stored with each asset."""
+import json
+
+from flask_restplus import marshal
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+
+from asset_store.api_serializers import ASSET_FIELDS_TO_SERIALIZE, canonical_json, render_asset_json
+from asset_store.models import Asset, notify_write
+
+
+# columns an asset's document can be rendered from, for rows that don't have a stored document (yet)
+DOCUMENT_COLUMNS = (Asset.asset_name, Asset.asset_json, Asset.asset_type, Asset.asset_class, Asset.asset_details_json)
+
+
+def row_document(row):
+    """Get the document of a row of DOCUMENT_COLUMNS, rendering it from the columns if none is stored.
+
+    Rows written by processes that predate stored documents (e.g. during a rolling deploy) have none until the next
+    startup backfills them.
+    """
+    if row.asset_json is not None:
+        return row.asset_json
+    details = json.loads(row.asset_details_json) if row.asset_details_json else {}
+    return render_asset_json(row.asset_name, row.asset_type.value, row.asset_class.value, details)
+
+
+def live_asset_json(asset):
+    """Serialize an asset from its columns, the way the api did before documents were stored."""
+    return canonical_json(marshal(asset, ASSET_FIELDS_TO_SERIALIZE))
+
+
+def ensure_document_column(engine):
+    """Add the asset_json column to an asset table created before it existed.
+
+    Returns:
+        added (bool): True if the column had to be added
+    """
+    columns = [column['name'] for column in inspect(engine).get_columns(Asset.__tablename__)]
+    if 'asset_json' in columns:
+        return False
+    try:
+        engine.execute('ALTER TABLE {} ADD COLUMN asset_json VARCHAR'.format(Asset.__tablename__))
+    except OperationalError as err:
+        # another process added it since we looked
+        if 'duplicate column name' not in str(err):
+            raise
+        return False
+    return True
+
+
+def _iter_assets(session, batch_size):
+    """Iterate over all assets in id order, loading batch_size at a time."""
+    last_id = 0
+    while True:
+        batch = session.query(Asset).filter(Asset.id > last_id).order_by(Asset.id).limit(batch_size).all()
+        if not batch:
+            return
+        last_id = batch[-1].id
+        for asset in batch:
+            yield asset
+
+
+def rebuild_asset_documents(session, batch_size=500):
+    """Re-render the stored document of every asset whose document is missing or out of date.
+
+    Args:
+        session (Session): session to read and write assets with
+        batch_size (int): how many assets to load and commit at a time
+    Returns:
+        rebuilt (list of strings): names of the assets whose documents were rewritten
+    """
+    rebuilt = []
+    pending = []
+    for asset in _iter_assets(session, batch_size):
+        document = render_asset_json(asset.asset_name, asset.asset_type.value, asset.asset_class.value,
+                                     asset.asset_details)
+        if asset.asset_json != document:
+            asset.asset_json = document
+            pending.append(asset.asset_name)
+        if len(pending) >= batch_size:
+            session.commit()
+            rebuilt.extend(pending)
+            pending = []
+    session.commit()
+    rebuilt.extend(pending)
+    for asset_name in rebuilt:
+        notify_write(asset_name)
+    return rebuilt
+
+
+def backfill_asset_documents(session, batch_size=500):
+    """Render and store the document of every asset that doesn't have one.
+
+    Args:
+        session (Session): session to read and write assets with
+        batch_size (int): how many assets to load and commit at a time
+    Returns:
+        filled (list of strings): names of the assets whose documents were stored
+    """
+    filled = []
+    while True:
+        batch = session.query(Asset).filter(Asset.asset_json.is_(None)).order_by(Asset.id).limit(batch_size).all()
+        if not batch:
+            break
+        for asset in batch:
+            asset.asset_json = render_asset_json(asset.asset_name, asset.asset_type.value, asset.asset_class.value,
+                                                 asset.asset_details)
+        session.commit()
+        filled.extend(asset.asset_name for asset in batch)
+    for asset_name in filled:
+        notify_write(asset_name)
+    return filled
+
+
+def upgrade_asset_documents(engine, session, batch_size=500):
+    """Add the asset_json column if it's missing, and store a document for every asset that has none.
+
+    Run at every startup, since processes that predate stored documents may still be writing assets without them.
+
+    Args:
+        engine (Engine): engine of the database holding the asset table
+        session (Session): session of the same database
+        batch_size (int): how many assets to load and commit at a time
+    Returns:
+        filled (list of strings): names of the assets whose documents were stored
+    """
+    ensure_document_column(engine)
+    return backfill_asset_documents(session, batch_size=batch_size)
+
+
+def verify_asset_documents(session, batch_size=500):
+    """Compare every stored document against live serialization of the asset's columns.
+
+    Args:
+        session (Session): session to read assets with
+        batch_size (int): how many assets to load at a time
+    Returns:
+        mismatches (list of tuples): (asset_name, stored document, live document) for each asset that differs
+    """
+    mismatches = []
+    for asset in _iter_assets(session, batch_size):
+        live = live_asset_json(asset)
+        if asset.asset_json != live:
+            mismatches.append((asset.asset_name, asset.asset_json, live))
+    return mismatches
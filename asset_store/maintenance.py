@@ -0,0 +1,392 @@
+"""Online backups and scheduled maintenance of the sqlite database.
+
+Maintenance runs on its own sqlite connection in a background thread. In wal mode backups copy the database in one
+step, since readers don't block writers there. Otherwise they use sqlite's online backup api a few pages at a time,
+releasing the database between steps so that writers are never stalled for the whole copy.
+
+Every worker process has a scheduler, but only the one holding a lock on the database's maintenance lock file runs
+tasks; if that worker exits, another one takes over. While a task runs, a marker file tells the other workers so that
+they can report their request latencies during maintenance too.
+"""
+import contextlib
+import fcntl
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask import g
+from sqlalchemy.engine.url import make_url
+
+from asset_store.metrics import metrics
+
+# how long (in seconds) a maintenance connection waits for a lock before giving up
+BUSY_TIMEOUT = 5
+
+# sqlite3's online backup api was added in Python 3.7
+ONLINE_BACKUP = hasattr(sqlite3.Connection, 'backup')
+
+
+class BackupError(sqlite3.Error):
+    """A backup that couldn't be completed (in time, or at all on this Python)."""
+
+    pass
+
+
+def sqlite_path(database_uri):
+    """Get the file path of a sqlite database uri, or None if it is not a sqlite file database."""
+    url = make_url(database_uri)
+    if url.drivername != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return url.database
+
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    """Hold an exclusive lock on a lock file, waiting for any other process holding it.
+
+    Does nothing if lock_path is None (e.g. for databases no other process can open).
+    """
+    if lock_path is None:
+        yield
+        return
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def prepare_database(engine, journal_mode=None):
+    """Set up a sqlite database for maintenance.
+
+    Turns on incremental auto_vacuum, which only takes effect if it runs before the first table is created (existing
+    databases are converted by the first incremental_vacuum maintenance task instead, see incremental_vacuum), and
+    optionally switches the journal mode (e.g. to 'wal'), which persists.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    engine.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    if journal_mode:
+        engine.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+
+
+def _connect(path):
+    # autocommit, so that pragmas like incremental_vacuum run outside of a transaction
+    return sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+
+
+def backup_database(source_path, target_path, pages=64, sleep=0.005, timeout=60):
+    """Copy a live database to target_path with sqlite's online backup api.
+
+    In wal mode the whole database is copied in one step. Otherwise it is copied pages at a time, and sqlite restarts
+    the copy whenever another connection writes to the database, so under sustained writes the backup gives up once
+    timeout seconds have passed rather than running forever.
+
+    Args:
+        source_path (string): path of the database to back up
+        target_path (string): path to write the backup to. It is replaced atomically once the backup is complete.
+        pages (int): how many pages to copy per step (outside of wal mode)
+        sleep (float): seconds to wait before retrying a step that found the database busy or locked
+        timeout (float): seconds after which an unfinished backup is abandoned
+    Returns:
+        steps (int): how many steps the backup took
+    Raises:
+        BackupError: if the backup didn't finish within timeout seconds, or this Python has no online backup api
+    """
+    if not ONLINE_BACKUP:
+        raise BackupError('Online backups need Python 3.7 or later.')
+    progress = {'steps': 0, 'remaining': None}
+    deadline = time.time() + timeout
+
+    def on_progress(status, remaining, total):
+        progress['steps'] += 1
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            metrics.incr('maintenance.backup.restarts')
+        progress['remaining'] = remaining
+        if remaining and time.time() > deadline:
+            raise BackupError('Backup of {} did not finish within {} seconds.'.format(source_path, timeout))
+
+    # each backup writes its own temporary file, so concurrent backups to the same target can't corrupt each other
+    directory, name = os.path.split(os.path.abspath(target_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+    os.close(fd)
+    try:
+        source = _connect(source_path)
+        try:
+            if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+                # readers don't block writers in wal mode, so copy everything from one consistent snapshot
+                pages = -1
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target, pages=pages, sleep=sleep, progress=on_progress)
+            finally:
+                target.close()
+        finally:
+            source.close()
+        os.rename(tmp_path, target_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return progress['steps']
+
+
+def analyze(path):
+    """Refresh the statistics the query planner uses."""
+    conn = _connect(path)
+    try:
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+
+
+def incremental_vacuum(path, pages=256, convert=False):
+    """Return up to pages free pages to the file system.
+
+    Args:
+        path (string): path of the database to vacuum
+        pages (int): most pages to free
+        convert (bool): switch a database that doesn't use incremental auto_vacuum over to it. That takes a full
+                        VACUUM, which rewrites the whole file (freeing every free page) and blocks writers until it's
+                        done, but only has to happen once.
+    Returns:
+        freed (int): how many pages were freed, or None if the database doesn't use incremental auto_vacuum (and
+                     wasn't converted)
+    """
+    conn = _connect(path)
+    try:
+        free_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            if not convert:
+                return None
+            # auto_vacuum can only be switched on for a database with tables by vacuuming it
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            metrics.incr('maintenance.incremental_vacuum.conversions')
+        else:
+            # executescript steps the pragma to completion; execute would only free one page
+            conn.executescript('PRAGMA incremental_vacuum({:d})'.format(pages))
+        return free_before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def wal_checkpoint(path):
+    """Copy committed pages from the write-ahead log into the database without blocking readers or writers.
+
+    Returns:
+        checkpointed (int): how many pages were checkpointed (-1 if the database is not in wal mode)
+    """
+    conn = _connect(path)
+    try:
+        return conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()[2]
+    finally:
+        conn.close()
+
+
+def partition_file_path(path, partition):
+    """Get the path of a partition's copy of a file, e.g. backup.satellite.db for backup.db."""
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, partition, ext)
+
+
+class MaintenanceScheduler(object):
+    """Run maintenance tasks on a database (and its asset partitions) at configurable intervals.
+
+    For each task, durations are observed as maintenance.<task>.duration and runs, errors and skips are counted. Backups
+    are skipped on Pythons without sqlite3's online backup api (before 3.7).
+    Request latencies observed while any task is running are also recorded separately, so that the effect of
+    maintenance on p99 latency can be compared with request.latency.
+    """
+
+    def __init__(self, path, intervals, backup_path=None, backup_pages=64, backup_timeout=60, vacuum_pages=256,
+                 partitions=None, lock_path=None, clock=time.time):
+        """Create a (not yet started) scheduler.
+
+        Args:
+            path (string): path of the sqlite database to maintain
+            intervals (dict): seconds between runs of each task, keyed by task name. Tasks that are left out
+                              (or have a falsy interval) never run.
+            backup_path (string): where to write backups. Partitions are backed up next to it (see
+                                  partition_file_path).
+            backup_pages (int): pages copied per backup step
+            backup_timeout (float): seconds after which an unfinished backup is abandoned
+            vacuum_pages (int): most pages freed per incremental vacuum
+            partitions (dict): paths of the sqlite databases of asset partitions to maintain with path, by partition
+            lock_path (string): lock file that elects the one process running tasks, or None to always run them
+            clock (callable): returns the current time in seconds
+        """
+        self.path = path
+        self.paths = [path] + [partition_path for _, partition_path in sorted((partitions or {}).items())]
+        self.clock = clock
+        # tasks return False when they were skipped, rather than run
+        self.tasks = {'analyze': lambda: self._each(analyze),
+                      'incremental_vacuum': lambda: self._each(lambda db_path: incremental_vacuum(
+                          db_path, vacuum_pages, convert=True)),
+                      'wal_checkpoint': lambda: self._each(wal_checkpoint)}
+        if backup_path:
+            backup_paths = dict((partition_path, partition_file_path(backup_path, partition))
+                                for partition, partition_path in (partitions or {}).items())
+            backup_paths[path] = backup_path
+            self.tasks['backup'] = lambda: ONLINE_BACKUP and self._each(lambda db_path: backup_database(
+                db_path, backup_paths[db_path], pages=backup_pages, timeout=backup_timeout))
+        self.intervals = dict((name, interval) for name, interval in intervals.items()
+                              if interval and name in self.tasks)
+        now = clock()
+        self._due = dict((name, now + interval) for name, interval in self.intervals.items())
+        self.lock_path = lock_path
+        self.marker_path = lock_path + '.active' if lock_path else None
+        self._lock_file = None
+        self._active = 0
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def active(self):
+        """True while a maintenance task is running, in this or any other worker process."""
+        return self._active > 0 or (self.marker_path is not None and os.path.exists(self.marker_path))
+
+    def elect(self):
+        """Try to become the process that runs maintenance tasks.
+
+        Returns:
+            elected (bool): True if this process holds the maintenance lock (always, without a lock_path)
+        """
+        if self.lock_path is None:
+            return True
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (OSError, IOError):
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        # left behind if the previous holder exited in the middle of a task
+        if os.path.exists(self.marker_path):
+            os.remove(self.marker_path)
+        metrics.incr('maintenance.elected')
+        return True
+
+    def run_task(self, name):
+        """Run one task now, recording its duration."""
+        self._active += 1
+        if self.marker_path is not None:
+            open(self.marker_path, 'w').close()
+        start = time.time()
+        try:
+            if self.tasks[name]() is False:
+                metrics.incr('maintenance.{}.skipped'.format(name))
+            else:
+                metrics.incr('maintenance.{}.runs'.format(name))
+        except (sqlite3.Error, OSError):
+            metrics.incr('maintenance.{}.errors'.format(name))
+        finally:
+            metrics.observe('maintenance.{}.duration'.format(name), time.time() - start)
+            self._active -= 1
+            if self.marker_path is not None:
+                os.remove(self.marker_path)
+        metrics.observe('maintenance.database_bytes',
+                        sum(os.path.getsize(db_path) for db_path in self.paths if os.path.exists(db_path)))
+
+    def _each(self, task):
+        """Run task on every database, even if it fails on some of them, then raise the first failure."""
+        errors = []
+        for db_path in self.paths:
+            try:
+                task(db_path)
+            except (sqlite3.Error, OSError) as err:
+                errors.append(err)
+        if errors:
+            raise errors[0]
+
+    def run_pending(self):
+        """Run every task that is due, if this process was elected to run them."""
+        if not self.elect():
+            return
+        for name in sorted(self._due):
+            if self.clock() >= self._due[name]:
+                self.run_task(name)
+                self._due[name] = self.clock() + self.intervals[name]
+
+    def start(self, tick=1.0):
+        """Check for due tasks every tick seconds on a background thread, unless it is already running here.
+
+        A scheduler inherited from a parent process (e.g. a worker forked from a preloaded app) starts its own thread
+        and forgets the parent's lock.
+        """
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            if self._lock_file is not None:
+                # a parent's lock file; closing our copy leaves the parent's lock alone
+                self._lock_file.close()
+                self._lock_file = None
+            self._stop = threading.Event()
+
+            def run():
+                while not self._stop.wait(tick):
+                    self.run_pending()
+
+            self._thread = threading.Thread(target=run, name='maintenance')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread (after any running task finishes) and give up the maintenance lock."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._pid = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def init_app(self, app):
+        """Observe request latencies for app, separately while maintenance is running.
+
+        The scheduler's thread is started by the first request in each worker process.
+        """
+        @app.before_request
+        def start_timer():
+            self.start()
+            g.maintenance_request_start = time.time()
+            g.maintenance_active = self.active
+
+        @app.teardown_request
+        def observe_latency(exc=None):
+            start = getattr(g, 'maintenance_request_start', None)
+            if start is None:
+                return
+            latency = time.time() - start
+            metrics.observe('request.latency', latency)
+            if g.maintenance_active or self.active:
+                metrics.observe('request.latency.during_maintenance', latency)
+
+
+def init_maintenance(app):
+    """Set up the maintenance scheduler for app if MAINTENANCE_ENABLED is set and it uses a sqlite file.
+
+    The sqlite files of any ASSET_PARTITIONS are maintained (and backed up) along with the default database.
+    """
+    if not app.config.get('MAINTENANCE_ENABLED'):
+        return None
+    path = sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+    if path is None:
+        return None
+    partitions = dict((partition, sqlite_path(uri)) for partition, uri in app.config.get('ASSET_PARTITIONS') or []
+                      if sqlite_path(uri) is not None)
+    scheduler = MaintenanceScheduler(path, app.config['MAINTENANCE_INTERVALS'],
+                                     backup_path=app.config.get('MAINTENANCE_BACKUP_PATH'),
+                                     backup_pages=app.config.get('MAINTENANCE_BACKUP_PAGES', 64),
+                                     backup_timeout=app.config.get('MAINTENANCE_BACKUP_TIMEOUT', 60),
+                                     vacuum_pages=app.config.get('MAINTENANCE_VACUUM_PAGES', 256),
+                                     partitions=partitions,
+                                     lock_path=path + '.maintenance.lock')
+    scheduler.init_app(app)
+    app.extensions['maintenance'] = scheduler
+    return scheduler
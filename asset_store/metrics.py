@@ -0,0 +1,88 @@
+"""In-process counters and timings for observing the asset_store app."""
+import threading
+from collections import deque
+
+# how many recent samples of each observation are kept for percentiles
+RESERVOIR_SIZE = 1024
+
+
+class _Observation(object):
+    """Summary of the values observed for one name."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+        self.recent.append(value)
+
+    def summary(self):
+        recent = sorted(self.recent)
+        return {'count': self.count,
+                'mean': self.total / self.count,
+                'max': self.max,
+                'last': self.recent[-1],
+                'p50': percentile(recent, 0.5),
+                'p99': percentile(recent, 0.99)}
+
+
+def percentile(sorted_values, fraction):
+    """Get the value at the given fraction of a sorted list."""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Metrics(object):
+    """A thread-safe registry of named counters and observations."""
+
+    def __init__(self):
+        """Start with no counters."""
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._observations = {}
+
+    def incr(self, name, value=1):
+        """Increment the counter called name by value."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Record a value (e.g. a duration in seconds) for name."""
+        with self._lock:
+            observation = self._observations.get(name)
+            if observation is None:
+                observation = self._observations[name] = _Observation()
+            observation.add(value)
+
+    def get(self, name):
+        """Get the current value of a counter (0 if it was never incremented)."""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def summary(self, name):
+        """Get count, mean, max, last, p50 and p99 of the values observed for name (None if there are none)."""
+        with self._lock:
+            observation = self._observations.get(name)
+            return observation.summary() if observation is not None else None
+
+    def snapshot(self):
+        """Get a copy of all counters, and a summary of each observation, as a dict."""
+        with self._lock:
+            snapshot = dict(self._counters)
+            for name, observation in self._observations.items():
+                snapshot[name] = observation.summary()
+            return snapshot
+
+    def reset(self):
+        """Clear all counters and observations."""
+        with self._lock:
+            self._counters.clear()
+            self._observations.clear()
+
+
+# a single registry shared by the whole process
+metrics = Metrics()
@@ -1,18 +1,40 @@
 """Database backed models for the asset store."""
 
 import json
-import re
-import six
 
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import Column, Integer, JSON, String
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy_utils import ChoiceType
 
-from asset_store.utils import get_choice_list, ResourceConflictError, ValidationError, validate_choice
+from asset_store.api_serializers import render_asset_json
+from asset_store.utils import ResourceConflictError, ValidationError
+from asset_store.validation import AssetValidator, check_boolean, check_float
+from asset_store.write_queue import get_write_queue
 
 db = SQLAlchemy()
 
+# callables notified with an asset_name after a write to that asset has been committed
+_write_listeners = []
+
+
+def register_write_listener(listener):
+    """Register a callable to be notified with an asset_name whenever that asset is written.
+
+    Listeners are called after the write is committed, so anything they load will see the new data.
+    """
+    if listener not in _write_listeners:
+        _write_listeners.append(listener)
+
+
+def notify_write(asset_name):
+    """Notify all write listeners that asset_name was written."""
+    for listener in _write_listeners:
+        listener(asset_name)
+
 
 class Asset(db.Model):
     """A model for tracking satellite and antenna assets."""
@@ -56,6 +78,8 @@ class Asset(db.Model):
     asset_class = Column(ChoiceType(ASSET_CLASSES), nullable=False)
     # store details as a string for now -- consider using a JSON column (requires a sqlite extension)
     asset_details_json = Column(String)
+    # the json document served for this asset, rendered whenever the asset is written
+    asset_json = Column(String)
 
     @property
     def asset_details(self):
@@ -70,9 +94,27 @@ class Asset(db.Model):
         if not isinstance(new_details, dict):
             raise ValidationError('Asset details should be a dict.')
         self._validate_asset_details_for_asset_class(new_details, self.asset_class.value)
-        self.asset_details_json = json.dumps(new_details)
-        db.session.add(self)
-        db.session.commit()
+        values = {'asset_details_json': json.dumps(new_details),
+                  'asset_json': render_asset_json(self.asset_name, self.asset_type.value, self.asset_class.value,
+                                                  new_details)}
+        write_queue = get_write_queue(current_app)
+        if write_queue is None:
+            for key, value in values.items():
+                setattr(self, key, value)
+            # assets loaded from a partition are committed through that partition's session
+            session = object_session(self) or db.session
+            session.add(self)
+            session.commit()
+            notify_write(self.asset_name)
+        else:
+            asset_id = self.id
+            asset_name = self.asset_name
+            # the writer notifies listeners, so that a write committed after submit timed out still invalidates
+            write_queue.submit(lambda session: session.query(Asset).filter(Asset.id == asset_id).update(
+                values, synchronize_session=False), on_commit=lambda: notify_write(asset_name))
+            # the writer committed the new values, so don't leave this instance dirty in the request's session
+            for key, value in values.items():
+                set_committed_value(self, key, value)
 
     @classmethod
     def create_asset(cls, asset_name, asset_type, asset_class, asset_details=None):
@@ -96,24 +138,29 @@ class Asset(db.Model):
             IntegrityError
         """
         from run import app
-        cls._validate_asset_name(asset_name)
-        cls._validate_asset_type(asset_type)
-        cls._validate_asset_class(asset_class)
-        cls._validate_asset_class_with_asset_type(asset_class, asset_type)
-
+        from asset_store.partitioning import get_partitioned_store
+        asset_validator.validate_asset(asset_name, asset_type, asset_class, asset_details)
         if not asset_details:
             asset_details = {}
-        else:
-            cls._validate_asset_details_for_asset_class(asset_details, asset_class)
 
         with app.app_context():
             try:
                 asset = Asset(asset_name=asset_name,
                               asset_type=asset_type,
                               asset_class=asset_class,
-                              asset_details_json=json.dumps(asset_details))
-                db.session.add(asset)
-                db.session.commit()
+                              asset_details_json=json.dumps(asset_details),
+                              asset_json=render_asset_json(asset_name, asset_type, asset_class, asset_details))
+                store = get_partitioned_store(app)
+                write_queue = get_write_queue(app)
+                if store is not None:
+                    store.create_asset(asset)
+                    notify_write(asset_name)
+                elif write_queue is None:
+                    db.session.add(asset)
+                    db.session.commit()
+                    notify_write(asset_name)
+                else:
+                    write_queue.submit(lambda session: session.add(asset), on_commit=lambda: notify_write(asset_name))
                 return asset
             except IntegrityError as err:
                 if 'UNIQUE constraint failed: asset.asset_name' in '{}'.format(err):
@@ -133,7 +180,7 @@ class Asset(db.Model):
         Raises:
             ValidationError: if provided asset_type value is not a valid choice
         """
-        return validate_choice('asset_type', asset_type, cls.ASSET_TYPES)
+        return asset_validator.validate_type(asset_type)
 
     @classmethod
     def _validate_asset_class(cls, asset_class):
@@ -146,7 +193,7 @@ class Asset(db.Model):
         Raises:
             ValidationError: if provided asset_class value is not a valid choice
         """
-        return validate_choice('asset_class', asset_class, cls.ASSET_CLASSES)
+        return asset_validator.validate_class(asset_class)
 
     @classmethod
     def _validate_asset_class_with_asset_type(cls, asset_class, asset_type):
@@ -160,19 +207,7 @@ class Asset(db.Model):
         Raises:
             ValidationError: if provided asset_class value is not a valid choice given the provided asset_type
         """
-        error_msg = 'Invalid asset_class. For the {} asset_type, valid asset_class values are: {}'
-        if asset_type == cls.ANTENNA:
-            choices = get_choice_list(cls.ANTENNA_CLASSES)
-            error_msg = error_msg.format(cls.ANTENNA, choices)
-            return validate_choice('asset_class', asset_class, cls.ANTENNA_CLASSES,
-                                   custom_error_msg=error_msg)
-        elif asset_type == cls.SATELLITE:
-            choices = get_choice_list(cls.SATELLITE_CLASSES)
-            error_msg = error_msg.format(cls.SATELLITE, choices)
-            return validate_choice('asset_class', asset_class, cls.SATELLITE_CLASSES,
-                                   custom_error_msg=error_msg)
-        else:
-            raise ValidationError('Unrecognized asset_type {}'.format(asset_type))
+        return asset_validator.validate_class_for_type(asset_class, asset_type)
 
     @classmethod
     def _validate_asset_name(cls, asset_name):
@@ -189,24 +224,7 @@ class Asset(db.Model):
                 - has already used by another asset
                 - starts with a '-' or '_'
         """
-        if not isinstance(asset_name, six.string_types):
-            raise ValidationError('asset_name must be a string.')
-
-        length = len(asset_name)
-        if length < 4:
-            raise ValidationError('asset_name must be at least 4 characters in length.')
-        if length > 64:
-            raise ValidationError('asset_name must be at most 64 characters in length.')
-
-        first_char = asset_name[0]
-        if first_char in ['-', '_']:
-            raise ValidationError('asset_name cannot begin with an underscore or dash.')
-
-        # should start with an alphanum and all subsequent characters should be alphanum or dashes
-        if re.match('^[0-9a-zA-Z]+[0-9a-zA-Z_-]*$', asset_name) is None:
-            raise ValidationError('asset_name may only contain alphanumeric ascii characters, underscores, and dashes.')
-
-        return True
+        return asset_validator.validate_name(asset_name)
 
     @classmethod
     def _get_asset_details_dict(cls, asset_details):
@@ -221,24 +239,11 @@ class Asset(db.Model):
     @classmethod
     def _check_for_unknown_asset_details_keys(cls, asset_details, asset_class):
         """Make sure details keys are supported."""
-        allowed_keys = []
-        if asset_class == cls.DISH:
-            allowed_keys = cls.DISH_DETAILS
-        if asset_class == cls.YAGI:
-            allowed_keys = cls.YAGI_DETAILS
-
-        keys = asset_details.keys()
-        for key in keys:
-            if key not in allowed_keys:
-                key_error_msg = 'key {} in asset_details is not supported for asset_class {}. allowed keys are: {}'
-                raise ValidationError(key_error_msg.format(key, asset_class, allowed_keys))
+        asset_validator.validate_details_keys(asset_details, asset_class)
 
     @classmethod
     def _validate_float_key(cls, name, value):
-        try:
-            float(value)
-        except ValueError:
-            raise ValidationError('{} in asset_details should have a float value'.format(name))
+        check_float(name, value)
 
     @classmethod
     def _validate_asset_details_for_asset_class(cls, asset_details, asset_class):
@@ -247,14 +252,25 @@ class Asset(db.Model):
         - asset_class dish can have diameter and radome details
         - asset_class yagi can have gain details
         """
-        cls._check_for_unknown_asset_details_keys(asset_details, asset_class)
-        for key, value in asset_details.items():
-            if key == cls.DIAMETER:
-                cls._validate_float_key(key, value)
-            elif key == cls.RADOME:
-                try:
-                    bool(value)
-                except ValueError:
-                    raise ValidationError('{} in asset_details should have a boolean value'.format(cls.RADOME))
-            elif key == cls.GAIN:
-                cls._validate_float_key(key, value)
+        return asset_validator.validate_details(asset_details, asset_class)
+
+
+class AssetNameClaim(db.Model):
+    """Which partition holds each asset_name, when assets are partitioned by asset_type.
+
+    Lives in the default database so that asset_name stays unique across all partitions.
+    """
+
+    asset_name = Column(String(64), primary_key=True)
+    partition = Column(String(64), nullable=False)
+
+
+# validation rules compiled once from the Asset model's choices
+asset_validator = AssetValidator(asset_types=Asset.ASSET_TYPES,
+                                 classes_by_type=[(Asset.ANTENNA, Asset.ANTENNA_CLASSES),
+                                                  (Asset.SATELLITE, Asset.SATELLITE_CLASSES)],
+                                 details_by_class={Asset.DISH: Asset.DISH_DETAILS,
+                                                   Asset.YAGI: Asset.YAGI_DETAILS},
+                                 detail_checks={Asset.DIAMETER: check_float,
+                                                Asset.RADOME: check_boolean,
+                                                Asset.GAIN: check_float})
@@ -0,0 +1,237 @@
+"""Horizontal partitioning of assets across several database files.
+
+Assets can be partitioned by asset_type (e.g. satellites and antennas in separate files) or by a hash of asset_name.
+Every partition is its own sqlite file with its own writer lock, so writes to different partitions don't wait on
+each other.
+
+Point lookups go straight to the partition that holds the asset: with hash partitioning the name alone picks the
+partition, and with asset_type partitioning an AssetNameClaim row in the default database records it. Those claims
+also keep asset_name unique across partitions; with hash partitioning a name can only ever land in one partition, so
+each partition's own unique constraint is enough. Claiming a name is a small write to the default database, so with
+asset_type partitioning creates still briefly take the default database's writer lock (details updates don't); hash
+partitioning keeps creates in different partitions fully independent. Listings query every partition in parallel and
+merge the results in asset_name order.
+
+Assets stored in the default database before partitioning was turned on are moved into their partitions by
+move_assets_to_partitions, which the app runs at startup.
+"""
+import heapq
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from asset_store.documents import DOCUMENT_COLUMNS, row_document
+from asset_store.maintenance import file_lock, prepare_database
+from asset_store.models import Asset, AssetNameClaim, db, notify_write
+from asset_store.utils import ResourceConflictError
+
+# ways of choosing an asset's partition
+BY_ASSET_TYPE = 'asset_type'
+BY_HASH = 'hash'
+
+
+class PartitionedStore(object):
+    """Route asset reads and writes to the database file of the asset's partition."""
+
+    def __init__(self, partitions, key=BY_ASSET_TYPE, max_workers=None, journal_mode=None):
+        """Connect to each partition, creating its asset table if needed.
+
+        Args:
+            partitions (list of pairs): (partition name, database uri) for each partition. When partitioning by
+                                        asset_type, the partition names are the asset_types, and every asset_type
+                                        needs a partition.
+            key (string): BY_ASSET_TYPE or BY_HASH
+            max_workers (int): threads shared by all listings, each of which uses one per partition it queries.
+                               Defaults to enough for 8 concurrent listings.
+            journal_mode (string): sqlite journal mode for the partitions (see prepare_database)
+        """
+        if key not in (BY_ASSET_TYPE, BY_HASH):
+            raise ValueError('Unknown partition key {}'.format(key))
+        self.key = key
+        self.names = [name for name, _ in partitions]
+        if key == BY_ASSET_TYPE:
+            missing = [asset_type for asset_type, _ in Asset.ASSET_TYPES if asset_type not in self.names]
+            if missing:
+                raise ValueError('No partition for asset_types {}'.format(missing))
+        self.engines = dict((name, create_engine(uri)) for name, uri in partitions)
+        self._sessionmakers = dict((name, sessionmaker(bind=engine)) for name, engine in self.engines.items())
+        self._sessions = dict((name, scoped_session(maker)) for name, maker in self._sessionmakers.items())
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or 8 * len(self.names))
+        for engine in self.engines.values():
+            prepare_database(engine, journal_mode)
+            Asset.__table__.create(engine, checkfirst=True)
+
+    def partition_for(self, asset_name, asset_type):
+        """Get the name of the partition a new asset belongs in."""
+        if self.key == BY_HASH:
+            # crc32 rather than hash() so every process agrees
+            return self.names[zlib.crc32(asset_name.encode('utf-8')) % len(self.names)]
+        return asset_type
+
+    def locate(self, asset_name):
+        """Get the name of the partition holding asset_name, or None if there is no such asset."""
+        if self.key == BY_HASH:
+            return self.partition_for(asset_name, None)
+        return db.session.query(AssetNameClaim.partition).filter(AssetNameClaim.asset_name == asset_name).scalar()
+
+    def session(self, partition):
+        """Get the current (request scoped) session for a partition."""
+        return self._sessions[partition]()
+
+    def remove_sessions(self, exc=None):
+        """Close every partition's request scoped session."""
+        for session in self._sessions.values():
+            session.remove()
+
+    def find_asset(self, asset_name):
+        """Get an asset by name, or None if there is no such asset."""
+        partition = self.locate(asset_name)
+        if partition is None:
+            return None
+        return self.session(partition).query(Asset).filter(Asset.asset_name == asset_name).one_or_none()
+
+    def get_document(self, asset_name):
+        """Get the json document of an asset, or None if there is no such asset."""
+        partition = self.locate(asset_name)
+        if partition is None:
+            return None
+        row = self.session(partition).query(*DOCUMENT_COLUMNS).filter(Asset.asset_name == asset_name).one_or_none()
+        return None if row is None else row_document(row)
+
+    def _list_partition(self, partition, filters):
+        """Get sorted (asset_name, document) pairs matching filters from one partition, on its own session."""
+        session = self._sessionmakers[partition]()
+        try:
+            query = session.query(*DOCUMENT_COLUMNS).filter_by(**filters).order_by(Asset.asset_name)
+            return [(row.asset_name, row_document(row)) for row in query]
+        finally:
+            session.close()
+
+    def list_documents(self, filters):
+        """Get the json documents of all assets matching filters, from every partition, in asset_name order."""
+        partitions = self.names
+        if self.key == BY_ASSET_TYPE and 'asset_type' in filters:
+            # only one partition can hold assets of a given type
+            partitions = [name for name in self.names if name == filters['asset_type']]
+        results = self._executor.map(lambda partition: self._list_partition(partition, filters), partitions)
+        return [document for _, document in heapq.merge(*results)]
+
+    def create_asset(self, asset):
+        """Insert a new asset into its partition.
+
+        Raises:
+            ResourceConflictError: if any partition already has an asset with the same asset_name
+        """
+        partition = self.partition_for(asset.asset_name, asset.asset_type)
+        conflict = ResourceConflictError('There is already an asset with asset_name {}'.format(asset.asset_name))
+        if self.key == BY_ASSET_TYPE:
+            try:
+                db.session.add(AssetNameClaim(asset_name=asset.asset_name, partition=partition))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                raise conflict
+
+        session = self._sessionmakers[partition](expire_on_commit=False)
+        try:
+            session.add(asset)
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            # an orphaned claim would make the name unreadable and impossible to create
+            if self.key == BY_ASSET_TYPE:
+                db.session.query(AssetNameClaim).filter(AssetNameClaim.asset_name == asset.asset_name).delete()
+                db.session.commit()
+            if isinstance(err, IntegrityError):
+                raise conflict
+            raise
+        finally:
+            session.close()
+        return asset
+
+    def move_assets(self, session, batch_size=500):
+        """Move assets from the default database's asset table into their partitions.
+
+        Each batch is copied into the partitions first and only then claimed and deleted from the default database,
+        so a move that is interrupted can simply be run again.
+
+        Args:
+            session (Session): session of the default database
+            batch_size (int): how many assets to move at a time
+        Returns:
+            moved (list of strings): names of the assets that were moved
+        """
+        moved = []
+        while True:
+            batch = session.query(Asset).order_by(Asset.id).limit(batch_size).all()
+            if not batch:
+                return moved
+            by_partition = {}
+            for asset in batch:
+                partition = self.partition_for(asset.asset_name, asset.asset_type.value)
+                by_partition.setdefault(partition, []).append(asset)
+            for partition, assets in by_partition.items():
+                self._copy_assets(partition, assets)
+                if self.key == BY_ASSET_TYPE:
+                    for asset in assets:
+                        session.merge(AssetNameClaim(asset_name=asset.asset_name, partition=partition))
+            for asset in batch:
+                session.delete(asset)
+            session.commit()
+            moved.extend(asset.asset_name for asset in batch)
+
+    def _copy_assets(self, partition, assets):
+        """Copy assets into a partition, skipping any already copied by an interrupted move."""
+        session = self._sessionmakers[partition]()
+        try:
+            names = [asset.asset_name for asset in assets]
+            copied = set(name for name, in session.query(Asset.asset_name).filter(Asset.asset_name.in_(names)))
+            for asset in assets:
+                if asset.asset_name not in copied:
+                    session.add(Asset(asset_name=asset.asset_name,
+                                      asset_type=asset.asset_type,
+                                      asset_class=asset.asset_class,
+                                      asset_details_json=asset.asset_details_json,
+                                      asset_json=asset.asset_json))
+            session.commit()
+        finally:
+            session.close()
+
+
+def move_assets_to_partitions(store, session, lock_path=None, batch_size=500):
+    """Move any assets left in the default database into their partitions, notifying write listeners of each.
+
+    Args:
+        store (PartitionedStore): the partitions to move assets into
+        session (Session): session of the default database
+        lock_path (string): lock file held while moving, so that only one process moves assets at a time
+        batch_size (int): how many assets to move at a time
+    Returns:
+        moved (list of strings): names of the assets that were moved
+    """
+    with file_lock(lock_path):
+        moved = store.move_assets(session, batch_size=batch_size)
+    for asset_name in moved:
+        notify_write(asset_name)
+    return moved
+
+
+def init_partitioned_store(app):
+    """Partition assets across the databases in ASSET_PARTITIONS, if any are configured."""
+    partitions = app.config.get('ASSET_PARTITIONS')
+    if not partitions:
+        return None
+    store = PartitionedStore(partitions, key=app.config.get('ASSET_PARTITION_KEY', BY_ASSET_TYPE),
+                             max_workers=app.config.get('ASSET_PARTITION_THREADS'),
+                             journal_mode=app.config.get('SQLITE_JOURNAL_MODE'))
+    app.teardown_appcontext(store.remove_sessions)
+    app.extensions['partitions'] = store
+    return store
+
+
+def get_partitioned_store(app):
+    """Get app's partitioned store, or None if assets are all kept in the default database."""
+    return app.extensions.get('partitions')
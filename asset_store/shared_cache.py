@@ -0,0 +1,283 @@
+"""A cache of asset documents shared by every worker process on a host.
+
+One small cache server process owns the cache; workers talk to it over a local (unix) socket, so every worker sees
+the same entries and an invalidation from any worker reaches all of them. Requests and replies are single lines of
+json, so nothing a client sends is ever executed, and the socket is created readable and writable by its owner only.
+
+Entries are versioned to keep a slow reader from caching stale data: a reader notes the version when it misses,
+loads from the database, and may only store its result if no write invalidated the key in the meantime.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+import six
+
+from asset_store.metrics import metrics
+from asset_store.models import register_write_listener
+
+# bytes charged against max_bytes for each remembered invalidation, on top of its key
+INVALIDATION_OVERHEAD = 16
+
+
+class CacheStore(object):
+    """An LRU cache of string values bounded by total size, with versions to reject stale fills.
+
+    Versions come from one counter that every invalidation bumps. The store remembers which version last invalidated
+    each key, so a fill that started before then can be rejected. Those records count against max_bytes too; when the
+    oldest is forgotten, every fill that started before it is rejected instead.
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        """Create an empty store.
+
+        Args:
+            max_bytes (int): most bytes of keys, values and invalidation records to hold before evicting the oldest
+            ttl (float): seconds an entry may be served for, which bounds staleness if an invalidation is lost
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.version = 0
+        self._entries = OrderedDict()  # key -> (value, time stored)
+        self._invalidations = OrderedDict()  # key -> version that last invalidated it, oldest first
+        self._oldest_valid = 0  # fills that started before this version are rejected
+
+    def get(self, key):
+        """Get (version, value) for key; value is None on a miss."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return self.version, None
+        value, stored_at = entry
+        if self.ttl is not None and time.time() - stored_at > self.ttl:
+            self.size -= len(key) + len(value)
+            return self.version, None
+        # re-insert to mark as most recently used
+        self._entries[key] = entry
+        return self.version, value
+
+    def set(self, key, version, value):
+        """Store value for key if key hasn't been invalidated since version was read.
+
+        Returns:
+            stored (bool): False if key was (or may have been) invalidated since version was read, or the value can
+                           never fit
+        """
+        if version < self._oldest_valid or self._invalidations.get(key, 0) > version:
+            return False
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return False
+        self._discard(key)
+        self._entries[key] = (value, time.time())
+        self.size += size
+        self._shrink()
+        return True
+
+    def invalidate(self, key):
+        """Drop key and record the invalidation so in-progress reads can't store stale values."""
+        self.version += 1
+        self._discard(key)
+        if self._invalidations.pop(key, None) is not None:
+            self.size -= len(key) + INVALIDATION_OVERHEAD
+        self._invalidations[key] = self.version
+        self.size += len(key) + INVALIDATION_OVERHEAD
+        self._shrink()
+
+    def stats(self):
+        """Get the number of entries and total bytes held."""
+        return {'entries': len(self._entries), 'bytes': self.size}
+
+    def _shrink(self):
+        """Forget the oldest invalidations, then the least recently used entries, until within max_bytes."""
+        while self.size > self.max_bytes and self._invalidations:
+            key, version = self._invalidations.popitem(last=False)
+            self.size -= len(key) + INVALIDATION_OVERHEAD
+            self._oldest_valid = max(self._oldest_valid, version)
+        while self.size > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(key) + len(entry[0])
+
+
+def _encode(message):
+    """Encode a message as one line of json."""
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+
+class CacheServer(object):
+    """Serve a CacheStore to worker processes over a local socket."""
+
+    # the argument types of each operation clients may call
+    OPERATIONS = {'get': (six.string_types,),
+                  'set': (six.string_types, six.integer_types, six.string_types),
+                  'invalidate': (six.string_types,),
+                  'stats': ()}
+
+    def __init__(self, address, max_bytes, ttl=None):
+        """Listen on address (a unix socket path) for cache clients."""
+        self.store = CacheStore(max_bytes, ttl=ttl)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the user running the server (and its workers) may connect
+        umask = os.umask(0o177)
+        try:
+            self._listener.bind(address)
+        finally:
+            os.umask(umask)
+        self._listener.listen(64)
+
+    def serve_forever(self):
+        """Accept clients until the server is closed, serving each on its own thread."""
+        while True:
+            try:
+                conn, _ = self._listener.accept()
+            except (OSError, IOError):
+                if self._closed:
+                    return
+                continue
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        """Stop listening for new clients."""
+        self._closed = True
+        try:
+            # wakes up a thread blocked in accept
+            self._listener.shutdown(socket.SHUT_RDWR)
+        except (OSError, IOError):
+            pass
+        self._listener.close()
+
+    def handle(self, line):
+        """Run one request line against the store, returning the reply line (a null result for bad requests)."""
+        try:
+            request = json.loads(line.decode('utf-8'))
+            operation, args = request['operation'], request['args']
+            arg_types = self.OPERATIONS[operation]
+        except (ValueError, KeyError, TypeError):
+            return _encode(None)
+        if (not isinstance(args, list) or len(args) != len(arg_types) or
+                not all(isinstance(arg, arg_type) for arg, arg_type in zip(args, arg_types))):
+            return _encode(None)
+        with self._lock:
+            result = getattr(self.store, operation)(*args)
+        return _encode(result)
+
+    def _serve(self, conn):
+        reader = conn.makefile('rb')
+        try:
+            for line in reader:
+                conn.sendall(self.handle(line))
+        except (OSError, IOError):
+            pass
+        finally:
+            reader.close()
+            conn.close()
+
+
+class SharedCacheClient(object):
+    """A worker's connection to the shared cache server.
+
+    The cache is an optimization, so failures never propagate: if the server can't be reached (or takes longer than
+    timeout seconds to reply), reads miss and writes are dropped, and reconnecting is only retried every
+    retry_interval seconds.
+    """
+
+    def __init__(self, address, retry_interval=1.0, timeout=1.0):
+        """Create a client for the server at address; it connects on first use."""
+        self.address = address
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._conn = None
+        self._reader = None
+        self._pid = None
+        self._retry_at = 0
+
+    def get(self, key):
+        """Get (version, value) for key; value is None on a miss."""
+        result = self._call('get', key)
+        if result is None:
+            metrics.incr('shared_cache.errors')
+            return None, None
+        metrics.incr('shared_cache.hits' if result[1] is not None else 'shared_cache.misses')
+        return tuple(result)
+
+    def set(self, key, version, value):
+        """Store value for key, unless key was invalidated since version was read (or the server is unavailable)."""
+        if version is None:
+            return False
+        return bool(self._call('set', key, version, value))
+
+    def invalidate(self, key):
+        """Drop key from the cache for every worker."""
+        metrics.incr('shared_cache.invalidations')
+        self._call('invalidate', key)
+
+    def stats(self):
+        """Get the number of entries and total bytes held by the server."""
+        return self._call('stats')
+
+    def _call(self, operation, *args):
+        with self._lock:
+            # a connection inherited from a parent process can't be shared with it
+            if self._conn is not None and self._pid != os.getpid():
+                self._close()
+            if self._conn is None:
+                if time.time() < self._retry_at:
+                    return None
+                try:
+                    self._connect()
+                except (OSError, IOError):
+                    self._close()
+                    self._retry_at = time.time() + self.retry_interval
+                    return None
+            try:
+                self._conn.sendall(_encode({'operation': operation, 'args': list(args)}))
+                line = self._reader.readline()
+                if not line:
+                    raise IOError('shared cache server closed the connection')
+                return json.loads(line.decode('utf-8'))
+            except (OSError, IOError, ValueError):
+                self._close()
+                return None
+
+    def _connect(self):
+        self._conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._conn.settimeout(self.timeout)
+        self._conn.connect(self.address)
+        self._reader = self._conn.makefile('rb')
+        self._pid = os.getpid()
+
+    def _close(self):
+        if self._reader is not None:
+            self._reader.close()
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        self._reader = None
+
+
+def init_shared_cache(app):
+    """Connect app to the shared cache server if SHARED_CACHE_ADDRESS is configured."""
+    address = app.config.get('SHARED_CACHE_ADDRESS')
+    if not address:
+        return None
+    client = SharedCacheClient(address)
+    register_write_listener(client.invalidate)
+    app.extensions['shared_cache'] = client
+    return client
+
+
+def get_shared_cache(app):
+    """Get app's shared cache client, or None if the shared cache is not in use."""
+    return app.extensions.get('shared_cache')
@@ -16,6 +16,12 @@ class ResourceConflictError(Exception):
     pass
 
 
+class WriteTimeoutError(Exception):
+    """Custom exception for writes that weren't committed in time."""
+
+    pass
+
+
 # choice field utils
 def get_choice_list(list_of_choice_tuples):
     """Map a list of choice_tuples to a list of choice strings.
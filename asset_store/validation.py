@@ -0,0 +1,151 @@
+"""Table-driven validation of asset payloads.
+
+The rules are compiled once into lookup tables (a precompiled name pattern, frozensets of choices, and an
+asset_type -> asset_class -> allowed asset_details keys table) so that validating an asset is a handful of set
+lookups. Error messages are the same ValidationError messages the Asset model has always raised.
+"""
+import re
+
+import six
+
+from asset_store.utils import ValidationError
+
+NAME_PATTERN = re.compile('^[0-9a-zA-Z]+[0-9a-zA-Z_-]*$')
+
+
+def check_float(name, value):
+    """Check that an asset_details value can be used as a float."""
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        raise ValidationError('{} in asset_details should have a float value'.format(name))
+
+
+def check_boolean(name, value):
+    """Check that an asset_details value can be used as a boolean."""
+    try:
+        bool(value)
+    except ValueError:
+        raise ValidationError('{} in asset_details should have a boolean value'.format(name))
+
+
+class _Choices(object):
+    """Valid choices as a list (for error messages) and a frozenset (for lookups)."""
+
+    def __init__(self, choice_tuples):
+        self.values = [choice[0] for choice in choice_tuples]
+        self.lookup = frozenset(self.values)
+
+
+class AssetValidator(object):
+    """Validate asset fields against rules compiled from a table of asset types, classes and details."""
+
+    def __init__(self, asset_types, classes_by_type, details_by_class, detail_checks):
+        """Compile the validation tables.
+
+        Args:
+            asset_types (list of tuples): ChoiceType list of tuples of valid asset_types
+            classes_by_type (list of pairs): (asset_type, ChoiceType list of tuples of its valid asset_classes)
+            details_by_class (dict): allowed asset_details keys (a list) for each asset_class that has details
+            detail_checks (dict): a check(name, value) function for each asset_details key
+        """
+        self.asset_types = _Choices(asset_types)
+        self.asset_classes = _Choices([choice for _, choices in classes_by_type for choice in choices])
+        self.classes_by_type = dict((asset_type, _Choices(choices)) for asset_type, choices in classes_by_type)
+        self.details_by_class = dict((asset_class, (frozenset(keys), list(keys)))
+                                     for asset_class, keys in details_by_class.items())
+        self.detail_checks = dict(detail_checks)
+
+    def _validate_choice(self, choice_name, choice_value, choices, custom_error_msg=None):
+        if not isinstance(choice_value, six.string_types):
+            raise ValidationError('{} must be a string.'.format(choice_name))
+        if choice_value in choices.lookup:
+            return True
+        if custom_error_msg is None:
+            custom_error_msg = '{} is not a valid choice for {}. Valid choices are: {}'.format(
+                choice_value, choice_name, choices.values)
+        raise ValidationError(custom_error_msg)
+
+    def validate_name(self, asset_name):
+        """Check if an asset_name value is valid (see Asset._validate_asset_name)."""
+        if not isinstance(asset_name, six.string_types):
+            raise ValidationError('asset_name must be a string.')
+
+        length = len(asset_name)
+        if length < 4:
+            raise ValidationError('asset_name must be at least 4 characters in length.')
+        if length > 64:
+            raise ValidationError('asset_name must be at most 64 characters in length.')
+
+        if asset_name[0] in '-_':
+            raise ValidationError('asset_name cannot begin with an underscore or dash.')
+
+        if NAME_PATTERN.match(asset_name) is None:
+            raise ValidationError('asset_name may only contain alphanumeric ascii characters, underscores, and dashes.')
+        return True
+
+    def validate_type(self, asset_type):
+        """Check if an asset_type value is valid."""
+        return self._validate_choice('asset_type', asset_type, self.asset_types)
+
+    def validate_class(self, asset_class):
+        """Check if an asset_class value is valid."""
+        return self._validate_choice('asset_class', asset_class, self.asset_classes)
+
+    def validate_class_for_type(self, asset_class, asset_type):
+        """Check if an asset_class value is valid for a given asset_type."""
+        choices = self.classes_by_type.get(asset_type) if isinstance(asset_type, six.string_types) else None
+        if choices is None:
+            raise ValidationError('Unrecognized asset_type {}'.format(asset_type))
+        error_msg = 'Invalid asset_class. For the {} asset_type, valid asset_class values are: {}'.format(
+            asset_type, choices.values)
+        return self._validate_choice('asset_class', asset_class, choices, custom_error_msg=error_msg)
+
+    def validate_details_keys(self, asset_details, asset_class):
+        """Make sure details keys are supported for an asset_class."""
+        allowed_lookup, allowed_keys = self.details_by_class.get(asset_class, (frozenset(), []))
+        for key in asset_details:
+            if key not in allowed_lookup:
+                key_error_msg = 'key {} in asset_details is not supported for asset_class {}. allowed keys are: {}'
+                raise ValidationError(key_error_msg.format(key, asset_class, allowed_keys))
+
+    def validate_details(self, asset_details, asset_class):
+        """Make sure that asset_details follow the business rules for an asset_class."""
+        self.validate_details_keys(asset_details, asset_class)
+        for key, value in asset_details.items():
+            check = self.detail_checks.get(key)
+            if check is not None:
+                check(key, value)
+        return True
+
+    def validate_asset(self, asset_name, asset_type, asset_class, asset_details=None):
+        """Validate all fields of a new asset, in the same order as Asset.create_asset.
+
+        Raises:
+            ValidationError: for the first field that doesn't meet validation constraints
+        """
+        self.validate_name(asset_name)
+        self.validate_type(asset_type)
+        self.validate_class(asset_class)
+        self.validate_class_for_type(asset_class, asset_type)
+        if asset_details:
+            self.validate_details(asset_details, asset_class)
+        return True
+
+    def validate_batch(self, assets):
+        """Validate many new assets in one pass.
+
+        Args:
+            assets (list of dicts): keyword arguments for Asset.create_asset for each asset
+        Returns:
+            errors (list): for each asset, None if it is valid, otherwise the ValidationError it would raise
+        """
+        errors = []
+        for asset in assets:
+            try:
+                self.validate_asset(asset.get('asset_name'), asset.get('asset_type'), asset.get('asset_class'),
+                                    asset.get('asset_details'))
+                errors.append(None)
+            except ValidationError as err:
+                errors.append(err)
+        return errors
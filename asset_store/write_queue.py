@@ -0,0 +1,195 @@
+"""Group commit of asset writes.
+
+With group commit enabled, writes are handed to a single writer thread instead of each request committing on its
+own. The writer collects whatever writes arrive within a short window, applies them in one transaction and commits
+once, so concurrent requests share a single sqlite lock acquisition and fsync. If the combined transaction fails
+(e.g. one write hits a unique constraint) the batch is replayed one write per transaction so that every caller gets
+its own success or failure.
+
+The writer thread is started by the first write in each process, so that workers forked from a parent that loaded
+the app (e.g. gunicorn --preload) get a writer of their own.
+"""
+import os
+import threading
+import time
+
+from six.moves import queue
+
+from asset_store.metrics import metrics
+from asset_store.utils import WriteTimeoutError
+
+# signals the writer thread to exit
+_STOP = object()
+
+
+class _PendingWrite(object):
+    """A write waiting for the writer thread, and its outcome once committed."""
+
+    def __init__(self, apply, on_commit=None):
+        self.apply = apply
+        self.on_commit = on_commit
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitQueue(object):
+    """Queue writes for a single writer thread that commits them in batches."""
+
+    def __init__(self, app, db, interval=0.005, max_batch=64, timeout=5.0):
+        """Create a (not yet started) queue.
+
+        Args:
+            app (Flask): app whose context the writer thread runs in
+            db (SQLAlchemy): database to write to
+            interval (float): how long (in seconds) the writer waits for more writes after the first of a batch
+            max_batch (int): most writes committed in one transaction
+            timeout (float): how long (in seconds) a caller waits for its write to be committed
+        """
+        self.app = app
+        self.db = db
+        self.interval = interval
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Start the writer thread for this process, if it isn't already running."""
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            # a queue or thread inherited from a parent process belongs to the parent's writer
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), name='group-commit-writer')
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        """Commit any queued writes, then stop the writer thread."""
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None:
+                return
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, apply, on_commit=None):
+        """Queue a write and wait until it has been committed.
+
+        Args:
+            apply (callable): called with the writer's session to stage the write; its return value is returned here
+            on_commit (callable): called by the writer once the write is committed, even if submit has already
+                                  timed out by then
+        Returns:
+            the return value of apply
+        Raises:
+            WriteTimeoutError: if the write wasn't committed within the timeout (it may still be committed later)
+            whatever exception applying or committing this write raised
+        """
+        self.start()
+        pending = _PendingWrite(apply, on_commit)
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            metrics.incr('group_commit.timeouts')
+            raise WriteTimeoutError('Write was not committed within {} seconds.'.format(self.timeout))
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _run(self, write_queue):
+        with self.app.app_context():
+            # objects handed back to callers outlive the writer's session, so keep their loaded state on commit
+            session = self.db.create_scoped_session({'expire_on_commit': False})
+            try:
+                stopping = False
+                while not stopping:
+                    batch, stopping = self._next_batch(write_queue)
+                    if batch:
+                        self._flush(session, batch)
+            finally:
+                session.remove()
+
+    def _next_batch(self, write_queue):
+        """Block for a write, then collect more until the interval passes or the batch is full."""
+        first = write_queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.time() + self.interval
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                pending = write_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if pending is _STOP:
+                return batch, True
+            batch.append(pending)
+        return batch, False
+
+    def _flush(self, session, batch):
+        """Commit a batch in one transaction, falling back to one transaction per write if it fails."""
+        metrics.incr('group_commit.batches')
+        metrics.incr('group_commit.writes', len(batch))
+        try:
+            results = [pending.apply(session) for pending in batch]
+            session.commit()
+        except Exception:
+            session.rollback()
+            metrics.incr('group_commit.replays')
+            for pending in batch:
+                self._flush_one(session, pending)
+        else:
+            for pending, result in zip(batch, results):
+                pending.result = result
+                self._committed(pending)
+        finally:
+            session.expunge_all()
+            for pending in batch:
+                pending.done.set()
+
+    def _flush_one(self, session, pending):
+        try:
+            pending.result = pending.apply(session)
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            pending.error = err
+        else:
+            self._committed(pending)
+
+    def _committed(self, pending):
+        if pending.on_commit is None:
+            return
+        try:
+            pending.on_commit()
+        except Exception:
+            # the write is committed either way; a failing callback mustn't stop the writer
+            metrics.incr('group_commit.callback_errors')
+
+
+def init_write_queue(app, db):
+    """Create a group commit queue for app if GROUP_COMMIT is enabled in its config.
+
+    The writer thread starts with the first write in each process.
+    """
+    # group commit only batches writes to the default database; partitioned assets are written per partition
+    if not app.config.get('GROUP_COMMIT') or app.config.get('ASSET_PARTITIONS'):
+        return None
+    write_queue = GroupCommitQueue(app, db,
+                                   interval=app.config.get('GROUP_COMMIT_INTERVAL_MS', 5) / 1000.0,
+                                   max_batch=app.config.get('GROUP_COMMIT_MAX_BATCH', 64),
+                                   timeout=app.config.get('GROUP_COMMIT_TIMEOUT', 5.0))
+    app.extensions['group_commit'] = write_queue
+    return write_queue
+
+
+def get_write_queue(app):
+    """Get the group commit queue for app, or None if writes are committed per request."""
+    return app.extensions.get('group_commit')
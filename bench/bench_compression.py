@@ -0,0 +1,68 @@
+"""Benchmark the cpu cost of compressing asset listings against the bandwidth saved.
+
+Usage: python bench/bench_compression.py [--assets 20000]
+
+Streams a synthetic listing through the compression middleware at several encodings and levels, and reports the
+compressed size, cpu time, and bytes saved per millisecond of cpu.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asset_store.api_resources import _stream_json_list  # noqa: E402
+from asset_store.api_serializers import canonical_json  # noqa: E402
+from asset_store.compression import CompressionMiddleware  # noqa: E402
+
+EXAMPLE_ASSETS = [
+    {'asset_name': 'dish-{:06d}', 'asset_type': 'antenna', 'asset_class': 'dish',
+     'asset_details': {'diameter': 2.4, 'radome': True}},
+    {'asset_name': 'yagi-{:06d}', 'asset_type': 'antenna', 'asset_class': 'yagi', 'asset_details': {'gain': 11.5}},
+    {'asset_name': 'dove-{:06d}', 'asset_type': 'satellite', 'asset_class': 'dove', 'asset_details': {}},
+    {'asset_name': 'rapideye-{:06d}', 'asset_type': 'satellite', 'asset_class': 'rapideye', 'asset_details': {}},
+]
+
+
+def make_listing(count):
+    """Make a list of count asset json documents."""
+    listing = []
+    for i in range(count):
+        asset = dict(EXAMPLE_ASSETS[i % len(EXAMPLE_ASSETS)])
+        asset['asset_name'] = asset['asset_name'].format(i)
+        listing.append(canonical_json(asset))
+    return listing
+
+
+def listing_app(listing):
+    """Make a WSGI app that streams listing the same way AssetListResource does."""
+    def wsgi_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return (chunk.encode('utf-8') for chunk in _stream_json_list(listing))
+    return wsgi_app
+
+
+def measure(wsgi_app, accept_encoding):
+    """Get (response size in bytes, cpu seconds) for one request."""
+    environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': accept_encoding}
+    start = time.process_time()
+    size = sum(len(chunk) for chunk in wsgi_app(environ, lambda status, headers, exc_info=None: None))
+    return size, time.process_time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--assets', type=int, default=20000)
+    args = parser.parse_args()
+
+    listing = make_listing(args.assets)
+    raw_size, raw_cpu = measure(listing_app(listing), 'identity')
+    print('{:>12}: {:10d} bytes  {:7.1f} ms cpu'.format('identity', raw_size, raw_cpu * 1000))
+    for encoding in ('gzip', 'deflate'):
+        for level in (1, 6, 9):
+            size, cpu = measure(CompressionMiddleware(listing_app(listing), level=level), encoding)
+            extra_cpu_ms = max(cpu - raw_cpu, 1e-6) * 1000
+            print('{:>12}: {:10d} bytes  {:7.1f} ms cpu  ratio {:5.1f}x  {:9.0f} bytes saved per cpu ms'.format(
+                '{} -{}'.format(encoding, level), size, cpu * 1000, float(raw_size) / size,
+                (raw_size - size) / extra_cpu_ms))
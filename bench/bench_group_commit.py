@@ -0,0 +1,89 @@
+"""Benchmark asset creation with per-request commits vs group commit.
+
+Usage: python bench/bench_group_commit.py [--threads 16] [--writes 200]
+
+Runs the same concurrent create_asset workload against a fresh sqlite file for each mode and reports sustained
+throughput along with p50/p99 write latency.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from run import app, db  # noqa: E402
+from asset_store.models import Asset  # noqa: E402
+from asset_store.write_queue import GroupCommitQueue  # noqa: E402
+
+
+def percentile(samples, fraction):
+    """Get the sample at the given fraction of a sorted list."""
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run_workload(threads, writes_per_thread):
+    """Create assets from many threads, returning (elapsed seconds, sorted latencies, error count)."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        for i in range(writes_per_thread):
+            name = 'bench-{}-{}'.format(worker_id, i)
+            start = time.time()
+            try:
+                Asset.create_asset(name, Asset.ANTENNA, Asset.DISH, {'diameter': 1.5, 'radome': True})
+            except Exception as err:
+                with lock:
+                    errors.append(err)
+                continue
+            with lock:
+                latencies.append(time.time() - start)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.time() - start, sorted(latencies), len(errors)
+
+
+def bench(mode, threads, writes_per_thread):
+    """Run the workload in one mode against a fresh database file."""
+    tmp_dir = tempfile.mkdtemp()
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(os.path.join(tmp_dir, 'bench.db'))
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    write_queue = None
+    if mode == 'group':
+        write_queue = GroupCommitQueue(app, db, interval=app.config['GROUP_COMMIT_INTERVAL_MS'] / 1000.0,
+                                       max_batch=app.config['GROUP_COMMIT_MAX_BATCH'])
+        write_queue.start()
+        app.extensions['group_commit'] = write_queue
+    try:
+        elapsed, latencies, error_count = run_workload(threads, writes_per_thread)
+    finally:
+        if write_queue is not None:
+            del app.extensions['group_commit']
+            write_queue.stop()
+        shutil.rmtree(tmp_dir)
+
+    print('{:>8}: {:8.1f} writes/s  p50 {:7.2f} ms  p99 {:7.2f} ms  errors {}'.format(
+        mode, len(latencies) / elapsed, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+        error_count))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=200, help='writes per thread')
+    args = parser.parse_args()
+    for mode in ('commit', 'group'):
+        bench(mode, args.threads, args.writes)
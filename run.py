@@ -1,8 +1,20 @@
 """This Asset Store is implemented as a Flask app with a RESTful web API."""
+import os
+import sys
+
+import click
 from flask import Flask
 
+from asset_store.admission import init_admission_control
 from asset_store.api_resources import api
+from asset_store.compression import CompressionMiddleware
+from asset_store.documents import rebuild_asset_documents, upgrade_asset_documents, verify_asset_documents
+from asset_store.maintenance import (backup_database, BackupError, file_lock, init_maintenance, partition_file_path,
+                                     prepare_database, sqlite_path)
 from asset_store.models import db
+from asset_store.partitioning import get_partitioned_store, init_partitioned_store, move_assets_to_partitions
+from asset_store.shared_cache import CacheServer, init_shared_cache
+from asset_store.write_queue import init_write_queue
 
 # yay, it's a flask app!
 # since the purpose of this project is to implement a demo RESTful web api in python,
@@ -21,13 +33,157 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////tmp/asset_store.db'
 # this setting is necessary to avoid pending deprecation warnings from sqlalchemy
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# optionally hand writes to a single writer thread that commits them in small batches (group commit).
+# sqlite only allows one writer at a time, so this trades a few milliseconds of latency for far less lock contention
+app.config['GROUP_COMMIT'] = False
+app.config['GROUP_COMMIT_INTERVAL_MS'] = 5
+app.config['GROUP_COMMIT_MAX_BATCH'] = 64
+# how long (in seconds) a request waits for its write to be committed before giving up with a 503
+app.config['GROUP_COMMIT_TIMEOUT'] = 5.0
+
+# responses are gzip/deflate compressed for clients that accept it.
+# responses smaller than the minimum size (in bytes) aren't worth the cpu; streamed responses are always compressed
+app.config['COMPRESSION_MIN_SIZE'] = 1024
+app.config['COMPRESSION_LEVEL'] = 6
+
+# optionally share a cache of asset documents between all worker processes on a host.
+# set the address to a unix socket path and start the cache server with `flask shared-cache`, as the same user as the
+# workers (only that user can connect to the socket)
+app.config['SHARED_CACHE_ADDRESS'] = None
+app.config['SHARED_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+# upper bound (in seconds) on how long an entry is served, in case an invalidation can't reach the cache server
+app.config['SHARED_CACHE_TTL'] = 300
+
+# optionally run database maintenance in the background: analyze, incremental vacuum, wal checkpoints and online
+# backups, each every so many seconds (leave a task out, or set it to None, to never run it).
+# durations are reported at /metrics, along with request latencies observed while maintenance was running.
+# only one worker process at a time runs the tasks (whichever holds the database's .maintenance.lock file)
+app.config['MAINTENANCE_ENABLED'] = False
+app.config['MAINTENANCE_INTERVALS'] = {'analyze': 60 * 60,
+                                       'incremental_vacuum': 10 * 60,
+                                       'wal_checkpoint': 60,
+                                       'backup': 60 * 60}
+app.config['MAINTENANCE_BACKUP_PATH'] = '/tmp/asset_store.backup.db'
+app.config['MAINTENANCE_BACKUP_PAGES'] = 64
+# outside of wal mode, writes restart a backup in progress, so give up on one that takes longer than this (in seconds)
+app.config['MAINTENANCE_BACKUP_TIMEOUT'] = 60
+app.config['MAINTENANCE_VACUUM_PAGES'] = 256
+# e.g. 'wal', so that readers don't block writers (and wal_checkpoint has something to do)
+app.config['SQLITE_JOURNAL_MODE'] = None
+
+# optionally limit each client (by X-User) to a request rate, and limit how many expensive (full listing) and cheap
+# (single asset) requests run at once. requests over a limit get a 429 with a Retry-After header
+app.config['ADMISSION_CONTROL'] = False
+app.config['RATE_LIMIT_PER_SECOND'] = 50
+app.config['RATE_LIMIT_BURST'] = 100
+app.config['CONCURRENCY_LIMITS'] = {'expensive': 4, 'cheap': 64}
+# how long (in seconds) a request may wait for a free concurrency slot before being rejected
+app.config['ADMISSION_QUEUE_TIMEOUT'] = 0.05
+
+# optionally partition assets across several database files, each with its own writer lock, e.g.
+#   [('satellite', 'sqlite:////tmp/asset_store.satellite.db'), ('antenna', 'sqlite:////tmp/asset_store.antenna.db')]
+# partitions are chosen by asset_type (there must then be a partition named for each asset_type) or by a 'hash' of
+# asset_name. the default database above still holds the asset_name directory used for asset_type partitioning, so
+# creates still briefly take its writer lock in that mode. assets already in the default database are moved into
+# their partitions at startup. group commit only applies to the default database; maintenance covers every partition
+app.config['ASSET_PARTITIONS'] = None
+app.config['ASSET_PARTITION_KEY'] = 'asset_type'
+# threads shared by all listings, which each query every partition in parallel (None for 8 listings' worth)
+app.config['ASSET_PARTITION_THREADS'] = None
+
 # initialize flask app models and api resources
 api.init_app(app)
 db.init_app(app)
 
-# create the database tables when the app runs
-with app.app_context():
+# create the database tables when the app runs.
+# every worker process does this as it starts, so they take turns holding the database's .schema.lock
+database_path = sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+with app.app_context(), file_lock(database_path + '.schema.lock' if database_path else None):
+    prepare_database(db.engine, app.config['SQLITE_JOURNAL_MODE'])
     db.create_all()
+    # databases created before assets stored their json documents need the column, and assets written by workers
+    # that predate it (e.g. during a rolling deploy) need their documents filled in
+    upgrade_asset_documents(db.engine, db.session)
+
+
+def _move_assets_to_partitions(store):
+    """Move assets left in the default database into their partitions, one process at a time."""
+    path = sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+    with app.app_context():
+        return move_assets_to_partitions(store, db.session, lock_path=path + '.partition.lock' if path else None)
+
+
+store = init_partitioned_store(app)
+if store is not None:
+    # assets created before partitioning was turned on would otherwise be invisible
+    _move_assets_to_partitions(store)
+init_write_queue(app, db)
+init_shared_cache(app)
+init_maintenance(app)
+init_admission_control(app)
+
+app.wsgi_app = CompressionMiddleware(app.wsgi_app,
+                                     min_size=app.config['COMPRESSION_MIN_SIZE'],
+                                     level=app.config['COMPRESSION_LEVEL'])
+
+
+@app.cli.command('rebuild-asset-documents')
+@click.option('--verify', is_flag=True, help='only report assets whose stored document differs from live serialization')
+def rebuild_asset_documents_command(verify):
+    """Rebuild (or verify) the stored json document of every asset."""
+    store = get_partitioned_store(app)
+    sessions = [db.session] if store is None else [store.session(name) for name in store.names]
+    if verify:
+        mismatches = [mismatch for session in sessions for mismatch in verify_asset_documents(session)]
+        for asset_name, stored, live in mismatches:
+            click.echo('{}\n  stored: {}\n  live:   {}'.format(asset_name, stored, live))
+        click.echo('{} mismatched asset documents'.format(len(mismatches)))
+        sys.exit(1 if mismatches else 0)
+    rebuilt = [asset_name for session in sessions for asset_name in rebuild_asset_documents(session)]
+    click.echo('rebuilt {} asset documents'.format(len(rebuilt)))
+
+
+@app.cli.command('partition-assets')
+def partition_assets_command():
+    """Move assets left in the default database into their partitions."""
+    store = get_partitioned_store(app)
+    if store is None:
+        raise click.UsageError('ASSET_PARTITIONS is not configured.')
+    click.echo('moved {} assets into partitions'.format(len(_move_assets_to_partitions(store))))
+
+
+@app.cli.command('shared-cache')
+def shared_cache_command():
+    """Run the cache server shared by all workers on this host."""
+    address = app.config['SHARED_CACHE_ADDRESS']
+    if not address:
+        raise click.UsageError('SHARED_CACHE_ADDRESS is not configured.')
+    if os.path.exists(address):
+        os.unlink(address)
+    server = CacheServer(address, app.config['SHARED_CACHE_MAX_BYTES'], ttl=app.config['SHARED_CACHE_TTL'])
+    click.echo('serving shared cache on {}'.format(address))
+    server.serve_forever()
+
+
+@app.cli.command('backup-database')
+@click.argument('target_path')
+def backup_database_command(target_path):
+    """Take an online backup of the database (and each asset partition) without blocking writers."""
+    path = sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+    if path is None:
+        raise click.UsageError('only sqlite file databases can be backed up.')
+    backups = [(path, target_path)]
+    for partition, uri in app.config['ASSET_PARTITIONS'] or []:
+        if sqlite_path(uri) is not None:
+            backups.append((sqlite_path(uri), partition_file_path(target_path, partition)))
+    for source_path, backup_path in backups:
+        try:
+            steps = backup_database(source_path, backup_path, pages=app.config['MAINTENANCE_BACKUP_PAGES'],
+                                    timeout=app.config['MAINTENANCE_BACKUP_TIMEOUT'])
+        except BackupError as err:
+            raise click.ClickException(str(err))
+        click.echo('backed up {} to {} in {} steps'.format(source_path, backup_path, steps))
+
 
 if __name__ == '__main__':
     # host is set for supporting docker port binding
@@ -0,0 +1,120 @@
+"""Admission Control Tests."""
+import json
+import unittest
+
+from run import app
+from asset_store.admission import (AdmissionController, CHEAP, ConcurrencyLimiter, EXPENSIVE, InMemoryBackend,
+                                   TokenBucket)
+from asset_store.metrics import metrics
+from asset_store.models import Asset
+from .test_utils import AppTestCase, FakeClock, VALID_ASSET_DICTS
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    """Tests for per-client rate limits."""
+
+    def test_burst_then_refill(self):
+        """A bucket should allow a burst, then one request per 1/rate seconds."""
+        bucket = TokenBucket(rate=2, burst=3, now=0)
+        self.assertEqual([bucket.take(0) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.take(0), 0.5)
+        self.assertAlmostEqual(bucket.take(0.25), 0.25)
+        self.assertEqual(bucket.take(0.5), 0)
+
+    def test_backend_tracks_clients_separately(self):
+        """Each client should have its own bucket."""
+        clock = FakeClock()
+        backend = InMemoryBackend(rate=1, burst=1, clock=clock)
+        self.assertEqual(backend.take('alice'), 0)
+        self.assertGreater(backend.take('alice'), 0)
+        self.assertEqual(backend.take('bob'), 0)
+        clock.now += 1
+        self.assertEqual(backend.take('alice'), 0)
+
+    def test_backend_is_bounded(self):
+        """The least recently seen clients should be forgotten."""
+        backend = InMemoryBackend(rate=1, burst=1, max_clients=2, clock=FakeClock())
+        for client in ('alice', 'bob', 'carol'):
+            backend.take(client)
+        self.assertEqual(list(backend._buckets), ['bob', 'carol'])
+
+    def test_concurrency_limiter(self):
+        """A full limiter should queue briefly, then reject."""
+        metrics.reset()
+        limiter = ConcurrencyLimiter(1, queue_timeout=0.01)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        self.assertEqual(metrics.get('admission.queued'), 1)
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+
+
+class AdmissionAPITestCase(AppTestCase):
+    """Admission control of api requests."""
+
+    def setUp(self):
+        """Turn on admission control with small limits."""
+        super(AdmissionAPITestCase, self).setUp()
+        metrics.reset()
+        self.clock = FakeClock()
+        self.limiters = {EXPENSIVE: ConcurrencyLimiter(1, queue_timeout=0.01),
+                         CHEAP: ConcurrencyLimiter(8, queue_timeout=0.01)}
+        app.extensions['admission'] = AdmissionController(InMemoryBackend(rate=1, burst=2, clock=self.clock),
+                                                          self.limiters)
+
+    def tearDown(self):
+        """Turn off admission control."""
+        del app.extensions['admission']
+
+    def _get(self, path, user):
+        """Get path as user, reading and closing the response body the way a wsgi server would."""
+        return self.app.get(path, headers={'X-User': user}, buffered=True)
+
+    def test_rate_limit(self):
+        """Clients over their rate should get a 429 with Retry-After, without affecting other clients."""
+        for _ in range(2):
+            self.assertEqual(self._get('/assets', 'greedy').status_code, 200)
+        response = self._get('/assets', 'greedy')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertIn('Rate limit', json.loads(response.get_data())['message'])
+        self.assertEqual(self._get('/assets', 'polite').status_code, 200)
+        self.assertEqual(metrics.get('admission.rejected'), 1)
+
+        self.clock.now += 1
+        self.assertEqual(self._get('/assets', 'greedy').status_code, 200)
+
+    def test_expensive_routes_have_their_own_limit(self):
+        """A full expensive limit should reject listings but not single-asset lookups."""
+        Asset.create_asset(**VALID_ASSET_DICTS[0])
+        self.limiters[EXPENSIVE].acquire()
+        try:
+            response = self._get('/assets', 'alice')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(metrics.get('admission.rejected.expensive'), 1)
+            path = '/assets/{}'.format(VALID_ASSET_DICTS[0]['asset_name'])
+            self.assertEqual(self._get(path, 'alice').status_code, 200)
+        finally:
+            self.limiters[EXPENSIVE].release()
+        self.clock.now += 1
+        self.assertEqual(self._get('/assets', 'alice').status_code, 200)
+
+    def test_streamed_listings_hold_their_slot(self):
+        """A listing should hold its expensive slot until its body has been sent."""
+        for asset_dict in VALID_ASSET_DICTS:
+            Asset.create_asset(**asset_dict)
+        streaming = self.app.get('/assets', headers={'X-User': 'alice'})
+        self.assertEqual(streaming.status_code, 200)
+        self.assertEqual(self._get('/assets', 'bob').status_code, 429)
+        self.assertEqual(len(json.loads(streaming.get_data())), len(VALID_ASSET_DICTS))
+        streaming.close()
+        self.assertEqual(self._get('/assets', 'bob').status_code, 200)
+
+    def test_unread_compressed_listing_releases_its_slot(self):
+        """A compressed listing closed before any of it was read (e.g. the client went away) should free its slot."""
+        for asset_dict in VALID_ASSET_DICTS:
+            Asset.create_asset(**asset_dict)
+        abandoned = self.app.get('/assets', headers={'X-User': 'alice', 'Accept-Encoding': 'gzip'})
+        self.assertEqual(abandoned.headers['Content-Encoding'], 'gzip')
+        abandoned.close()
+        self.assertEqual(self._get('/assets', 'bob').status_code, 200)
@@ -0,0 +1,135 @@
+"""Coalescing Tests."""
+import json
+import threading
+import unittest
+
+from asset_store.coalescing import SingleFlight
+from asset_store.metrics import metrics
+from asset_store.models import Asset
+from .test_utils import AppTestCase, VALID_ASSET_DICTS
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """Tests for sharing in-flight calls."""
+
+    def setUp(self):
+        """Use a fresh group and fresh counters for each test."""
+        metrics.reset()
+        self.flights = SingleFlight('test')
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.calls = []
+
+    def _slow_fetch(self):
+        """A fetch that blocks until the test releases it."""
+        self.calls.append(1)
+        self.started.set()
+        self.release.wait(5)
+        return {'asset_name': 'hello'}
+
+    def _call_in_thread(self, results, key, asset_name=None):
+        thread = threading.Thread(target=lambda: results.append(self.flights.do(key, self._slow_fetch, asset_name)))
+        thread.start()
+        return thread
+
+    def _wait_for_followers(self, count):
+        """Wait until count callers are blocked on an in-flight call."""
+        for _ in range(500):
+            if metrics.get('test.coalesced') >= count:
+                return
+            threading.Event().wait(0.01)
+
+    def test_concurrent_identical_calls_share_one_fetch(self):
+        """Callers arriving while a call is in flight should get its result without fetching."""
+        results = []
+        threads = [self._call_in_thread(results, ('asset', 'hello'), 'hello')]
+        self.started.wait(5)
+        threads.extend(self._call_in_thread(results, ('asset', 'hello'), 'hello') for _ in range(4))
+        self._wait_for_followers(4)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(metrics.get('test.executed'), 1)
+        self.assertEqual(metrics.get('test.coalesced'), 4)
+
+    def test_sequential_calls_are_not_cached(self):
+        """Once a call finishes, the next caller should fetch again."""
+        self.release.set()
+        self.flights.do('key', self._slow_fetch)
+        self.flights.do('key', self._slow_fetch)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(metrics.get('test.coalesced'), 0)
+
+    def test_errors_are_shared(self):
+        """Followers should see the exception raised by the leader."""
+        def failing_fetch():
+            self.started.set()
+            self.release.wait(5)
+            raise ValueError('boom')
+
+        errors = []
+
+        def call():
+            try:
+                self.flights.do('key', failing_fetch)
+            except ValueError as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        self.started.wait(5)
+        threads.append(threading.Thread(target=call))
+        threads[1].start()
+        self._wait_for_followers(1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(errors), 2)
+
+    def test_invalidate_stops_sharing(self):
+        """A write to an asset should make later callers start a fresh fetch."""
+        results = []
+        first = self._call_in_thread(results, ('asset', 'hello'), 'hello')
+        self.started.wait(5)
+        self.flights.invalidate('hello')
+        self.release.set()
+        self.flights.do(('asset', 'hello'), self._slow_fetch, 'hello')
+        first.join(5)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(metrics.get('test.invalidated'), 1)
+
+    def test_invalidate_other_asset_keeps_sharing(self):
+        """A write to an unrelated asset should not detach an in-flight read."""
+        results = []
+        self._call_in_thread(results, ('asset', 'hello'), 'hello')
+        self.started.wait(5)
+        self.flights.invalidate('goodbye')
+        self.assertEqual(metrics.get('test.invalidated'), 0)
+        self.release.set()
+
+    def test_invalidate_detaches_listings(self):
+        """A write to any asset should detach in-flight listings."""
+        results = []
+        self._call_in_thread(results, ('list', ()))
+        self.started.wait(5)
+        self.flights.invalidate('hello')
+        self.assertEqual(metrics.get('test.invalidated'), 1)
+        self.release.set()
+
+
+class MetricsAPITestCase(AppTestCase):
+    """MetricsResource tests."""
+
+    def test_reads_are_counted(self):
+        """The metrics endpoint should report coalescing counters."""
+        metrics.reset()
+        Asset.create_asset(**VALID_ASSET_DICTS[0])
+        self.app.get('/assets/{}'.format(VALID_ASSET_DICTS[0]['asset_name']))
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        counters = json.loads(response.get_data())
+        self.assertEqual(counters['coalescing.executed'], 1)
@@ -0,0 +1,148 @@
+"""Compression Tests."""
+import ddt
+import gzip
+import io
+import json
+import unittest
+import zlib
+
+from asset_store.compression import CompressionMiddleware, negotiate_encoding
+from asset_store.models import Asset
+from .test_utils import AppTestCase, VALID_ASSET_DICTS
+
+
+def make_wsgi_app(chunks, content_type='application/json', content_length=True):
+    """Make a tiny WSGI app that responds with the given chunks."""
+    def wsgi_app(environ, start_response):
+        headers = [('Content-Type', content_type)]
+        if content_length:
+            headers.append(('Content-Length', str(sum(len(chunk) for chunk in chunks))))
+        start_response('200 OK', headers)
+        return iter(chunks)
+    return wsgi_app
+
+
+def call(wsgi_app, accept_encoding=None):
+    """Call a WSGI app, returning (headers dict, body bytes)."""
+    environ = {'REQUEST_METHOD': 'GET'}
+    if accept_encoding is not None:
+        environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured.update(headers)
+
+    body = b''.join(wsgi_app(environ, start_response))
+    return captured, body
+
+
+@ddt.ddt
+class NegotiateEncodingTestCase(unittest.TestCase):
+    """Tests for picking a content-coding."""
+
+    @ddt.data(('gzip', 'gzip'),
+              ('gzip, deflate', 'gzip'),
+              ('deflate', 'deflate'),
+              ('gzip;q=0.5, deflate', 'deflate'),
+              ('gzip;q=0, deflate;q=0', None),
+              ('*', 'gzip'),
+              ('br', None),
+              ('', None),
+              ('identity', None))
+    @ddt.unpack
+    def test_negotiate_encoding(self, accept_encoding, expected):
+        """Should pick the client's preferred supported encoding."""
+        self.assertEqual(negotiate_encoding(accept_encoding), expected)
+
+
+class CompressionMiddlewareTestCase(unittest.TestCase):
+    """Tests for the compression WSGI middleware."""
+
+    big_chunks = [b'{"asset_type": "antenna", "asset_class": "dish"}'] * 100
+
+    def test_gzip(self):
+        """Large responses should be gzipped for clients that accept gzip."""
+        headers, body = call(CompressionMiddleware(make_wsgi_app(self.big_chunks)), 'gzip')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(body)).read(), b''.join(self.big_chunks))
+
+    def test_deflate(self):
+        """Large responses should be deflated for clients that only accept deflate."""
+        headers, body = call(CompressionMiddleware(make_wsgi_app(self.big_chunks)), 'deflate')
+        self.assertEqual(headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(body), b''.join(self.big_chunks))
+
+    def test_streamed(self):
+        """Streamed responses (no Content-Length) should be compressed regardless of size."""
+        chunks = [b'[', b'{}', b']']
+        wsgi_app = CompressionMiddleware(make_wsgi_app(chunks, content_length=False))
+        headers, body = call(wsgi_app, 'gzip')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(body)).read(), b'[{}]')
+
+    def test_small_responses_skip_compression(self):
+        """Responses under the size threshold should be passed through."""
+        headers, body = call(CompressionMiddleware(make_wsgi_app([b'{}']), min_size=1024), 'gzip')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, b'{}')
+
+    def test_not_accepted(self):
+        """Clients that don't accept a supported encoding should get the raw response."""
+        headers, body = call(CompressionMiddleware(make_wsgi_app(self.big_chunks)))
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, b''.join(self.big_chunks))
+
+    def test_close_before_reading(self):
+        """Closing a compressed body, even before reading any of it, should close the wrapped app's body."""
+        closed = []
+
+        class Body(object):
+            def __iter__(self):
+                return iter([b'[', b'{}', b']'])
+
+            def close(self):
+                closed.append(True)
+
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'application/json')])
+            return Body()
+
+        body = CompressionMiddleware(wsgi_app)({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+                                               lambda status, headers, exc_info=None: None)
+        body.close()
+        self.assertEqual(closed, [True])
+
+        body = CompressionMiddleware(wsgi_app)({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+                                               lambda status, headers, exc_info=None: None)
+        next(iter(body))
+        body.close()
+        self.assertEqual(closed, [True, True])
+
+    def test_incompressible_content_type(self):
+        """Binary content types should be passed through."""
+        headers, _ = call(CompressionMiddleware(make_wsgi_app(self.big_chunks, content_type='image/png')), 'gzip')
+        self.assertNotIn('Content-Encoding', headers)
+
+
+class CompressionAPITestCase(AppTestCase):
+    """Compression of api responses."""
+
+    def test_get_assets_list__gzip(self):
+        """Asset listings should be gzipped when the client accepts it."""
+        for asset_dict in VALID_ASSET_DICTS:
+            Asset.create_asset(**asset_dict)
+        response = self.app.get('/assets', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        body = gzip.GzipFile(fileobj=io.BytesIO(response.get_data())).read()
+        self.assertEqual(json.loads(body.decode('utf-8')), VALID_ASSET_DICTS)
+
+    def test_get_single_asset__small(self):
+        """Single assets are small enough to skip compression."""
+        Asset.create_asset(**VALID_ASSET_DICTS[0])
+        path = '/assets/{}'.format(VALID_ASSET_DICTS[0]['asset_name'])
+        response = self.app.get(path, headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json.loads(response.get_data()), VALID_ASSET_DICTS[0])
@@ -0,0 +1,151 @@
+"""Stored Asset Document Tests."""
+import ddt
+import json
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from run import app, db
+from asset_store import documents
+from asset_store.documents import (backfill_asset_documents, ensure_document_column, live_asset_json,
+                                   rebuild_asset_documents, upgrade_asset_documents, verify_asset_documents)
+from asset_store.models import Asset
+from .test_utils import AppTestCase, VALID_ASSET_DICTS
+
+
+@ddt.ddt
+class AssetDocumentsTestCase(AppTestCase):
+    """Tests for the pre-rendered json document stored with each asset."""
+
+    def _get_asset(self, asset_name):
+        return db.session.query(Asset).filter(Asset.asset_name == asset_name).one()
+
+    @ddt.data(*VALID_ASSET_DICTS)
+    def test_create_asset_stores_document(self, asset_dict):
+        """Creating an asset should store a document matching live serialization."""
+        Asset.create_asset(**asset_dict)
+        with app.app_context():
+            asset = self._get_asset(asset_dict['asset_name'])
+            self.assertEqual(asset.asset_json, live_asset_json(asset))
+            self.assertEqual(json.loads(asset.asset_json), asset_dict)
+
+    def test_update_details_stores_document(self):
+        """Updating details should re-render the stored document."""
+        asset_dict = [d for d in VALID_ASSET_DICTS if d['asset_class'] == Asset.YAGI][0]
+        Asset.create_asset(**asset_dict)
+        with app.app_context():
+            self._get_asset(asset_dict['asset_name']).update_details({'gain': 3.5})
+            asset = self._get_asset(asset_dict['asset_name'])
+            self.assertEqual(json.loads(asset.asset_json)['asset_details'], {'gain': 3.5})
+            self.assertEqual(asset.asset_json, live_asset_json(asset))
+
+    def test_verify_and_rebuild(self):
+        """Verification should report stale documents and a rebuild should fix them."""
+        for asset_dict in VALID_ASSET_DICTS:
+            Asset.create_asset(**asset_dict)
+        stale_name = VALID_ASSET_DICTS[0]['asset_name']
+        with app.app_context():
+            self.assertEqual(verify_asset_documents(db.session), [])
+            db.session.query(Asset).filter(Asset.asset_name == stale_name).update({'asset_json': None})
+            db.session.commit()
+
+            mismatches = verify_asset_documents(db.session, batch_size=2)
+            self.assertEqual([asset_name for asset_name, _, _ in mismatches], [stale_name])
+
+            self.assertEqual(rebuild_asset_documents(db.session, batch_size=2), [stale_name])
+            self.assertEqual(verify_asset_documents(db.session), [])
+
+    def test_get_asset_serves_stored_document(self):
+        """Reads should serve the stored document as is."""
+        asset_dict = VALID_ASSET_DICTS[0]
+        Asset.create_asset(**asset_dict)
+        with app.app_context():
+            asset = self._get_asset(asset_dict['asset_name'])
+            document = asset.asset_json
+        response = self.app.get('/assets/{}'.format(asset_dict['asset_name']))
+        self.assertEqual(response.get_data(as_text=True), document)
+        self.assertEqual(response.mimetype, 'application/json')
+        response = self.app.get('/assets')
+        self.assertEqual(response.get_data(as_text=True), '[{}]\n'.format(document))
+
+    def test_missing_document_is_rendered_from_columns(self):
+        """Assets without a stored document (e.g. written by an older worker) should still be served in full."""
+        for asset_dict in VALID_ASSET_DICTS:
+            Asset.create_asset(**asset_dict)
+        with app.app_context():
+            db.session.query(Asset).update({'asset_json': None})
+            db.session.commit()
+        for asset_dict in VALID_ASSET_DICTS:
+            response = self.app.get('/assets/{}'.format(asset_dict['asset_name']))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.get_data()), asset_dict)
+        response = self.app.get('/assets')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data()), VALID_ASSET_DICTS)
+
+    def test_backfill_missing_documents(self):
+        """Backfilling should store a document for exactly the assets that have none."""
+        for asset_dict in VALID_ASSET_DICTS:
+            Asset.create_asset(**asset_dict)
+        missing = [d['asset_name'] for d in VALID_ASSET_DICTS[:3]]
+        with app.app_context():
+            db.session.query(Asset).filter(Asset.asset_name.in_(missing)).update({'asset_json': None},
+                                                                                 synchronize_session=False)
+            db.session.commit()
+            self.assertEqual(backfill_asset_documents(db.session, batch_size=2), missing)
+            self.assertEqual(backfill_asset_documents(db.session), [])
+            self.assertEqual(verify_asset_documents(db.session), [])
+
+
+class DocumentColumnTestCase(AppTestCase):
+    """Tests for upgrading databases created before assets stored their documents."""
+
+    def setUp(self):
+        """Create an asset table without the asset_json column in a temporary sqlite file."""
+        super(DocumentColumnTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'assets.db')
+        self.engine = create_engine('sqlite:///' + self.path)
+        self.engine.execute('CREATE TABLE asset (id INTEGER PRIMARY KEY, asset_name VARCHAR(64), '
+                            'asset_type VARCHAR(255), asset_class VARCHAR(255), asset_details_json VARCHAR)')
+        self.engine.execute("INSERT INTO asset (asset_name, asset_type, asset_class, asset_details_json) "
+                            "VALUES ('old-dish', 'antenna', 'dish', '{\"diameter\": \"2.5\"}')")
+
+    def tearDown(self):
+        """Remove the temporary database."""
+        self.engine.dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_upgrade(self):
+        """Upgrading should add the column and fill in the documents, and do nothing the second time."""
+        session = sessionmaker(bind=self.engine)()
+        try:
+            self.assertEqual(upgrade_asset_documents(self.engine, session), ['old-dish'])
+            self.assertEqual(upgrade_asset_documents(self.engine, session), [])
+        finally:
+            session.close()
+        document = self.engine.execute('SELECT asset_json FROM asset').scalar()
+        self.assertEqual(json.loads(document), {'asset_name': 'old-dish', 'asset_type': 'antenna',
+                                                'asset_class': 'dish', 'asset_details': {'diameter': '2.5'}})
+
+    def test_column_added_by_another_process(self):
+        """Losing the race to add the column to another process shouldn't be an error."""
+        class StaleInspector(object):
+            """Reports the columns as they were before the other process added asset_json."""
+
+            def __init__(self, engine):
+                pass
+
+            def get_columns(self, table_name):
+                return [{'name': 'id'}, {'name': 'asset_name'}]
+
+        inspect = documents.inspect
+        self.assertTrue(ensure_document_column(self.engine))
+        documents.inspect = StaleInspector
+        try:
+            self.assertFalse(ensure_document_column(self.engine))
+        finally:
+            documents.inspect = inspect
@@ -0,0 +1,239 @@
+"""Maintenance Tests."""
+import ddt
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from flask import Flask
+
+from asset_store import maintenance
+from asset_store.maintenance import (backup_database, BackupError, incremental_vacuum, MaintenanceScheduler,
+                                     ONLINE_BACKUP, sqlite_path, wal_checkpoint)
+from asset_store.metrics import metrics
+from .test_utils import FakeClock
+
+
+@ddt.ddt
+class MaintenanceTestCase(unittest.TestCase):
+    """Tests for database maintenance tasks."""
+
+    def setUp(self):
+        """Create a sqlite database file with some rows in it."""
+        metrics.reset()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'asset_store.db')
+        self.conn = sqlite3.connect(self.path, isolation_level=None)
+
+    def tearDown(self):
+        """Remove the database files."""
+        self.conn.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _pragma(self, name):
+        # self.conn keeps reporting the auto_vacuum mode it first read, so check on a fresh connection
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('PRAGMA {}'.format(name)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def _fill(self, rows=2000):
+        self.conn.execute('CREATE TABLE asset (id INTEGER PRIMARY KEY, asset_name VARCHAR(64))')
+        self.conn.executemany('INSERT INTO asset (asset_name) VALUES (?)',
+                              [('asset-{:06d}'.format(i),) for i in range(rows)])
+
+    @ddt.data(('sqlite:////tmp/asset_store.db', '/tmp/asset_store.db'),
+              ('sqlite:///:memory:', None),
+              ('sqlite://', None),
+              ('postgresql://localhost/asset_store', None))
+    @ddt.unpack
+    def test_sqlite_path(self, uri, expected):
+        """Only sqlite file databases have a path to maintain."""
+        self.assertEqual(sqlite_path(uri), expected)
+
+    @unittest.skipUnless(ONLINE_BACKUP, 'online backups need Python 3.7 or later')
+    def test_backup_database(self):
+        """A backup should contain every row, copied in several small steps."""
+        self._fill()
+        target_path = os.path.join(self.tmp_dir, 'backup.db')
+        steps = backup_database(self.path, target_path, pages=1, sleep=0)
+        self.assertGreater(steps, 1)
+        backup = sqlite3.connect(target_path)
+        self.assertEqual(backup.execute('SELECT count(*) FROM asset').fetchone()[0], 2000)
+        backup.close()
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['asset_store.db', 'backup.db'])
+
+    @unittest.skipUnless(ONLINE_BACKUP, 'online backups need Python 3.7 or later')
+    def test_backup_database__wal(self):
+        """In wal mode a backup should copy everything in one step."""
+        self.conn.execute('PRAGMA journal_mode = wal')
+        self._fill()
+        target_path = os.path.join(self.tmp_dir, 'backup.db')
+        self.assertEqual(backup_database(self.path, target_path, pages=1, sleep=0), 1)
+        backup = sqlite3.connect(target_path)
+        self.assertEqual(backup.execute('SELECT count(*) FROM asset').fetchone()[0], 2000)
+        backup.close()
+
+    @unittest.skipUnless(ONLINE_BACKUP, 'online backups need Python 3.7 or later')
+    def test_backup_database__timeout(self):
+        """A backup that can't finish in time should be abandoned without leaving files behind."""
+        self._fill()
+        target_path = os.path.join(self.tmp_dir, 'backup.db')
+        with self.assertRaises(BackupError):
+            backup_database(self.path, target_path, pages=1, sleep=0, timeout=-1)
+        self.assertEqual(os.listdir(self.tmp_dir), ['asset_store.db'])
+
+    def test_incremental_vacuum(self):
+        """Incremental vacuum should free pages left behind by deletes."""
+        self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self._fill()
+        self.conn.execute('DELETE FROM asset')
+        self.assertGreater(incremental_vacuum(self.path), 0)
+        self.assertEqual(self.conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
+
+    def test_incremental_vacuum__not_enabled(self):
+        """Databases without incremental auto_vacuum should be left alone."""
+        self._fill()
+        self.assertIsNone(incremental_vacuum(self.path))
+
+    def test_incremental_vacuum__convert(self):
+        """Converting a database should switch it to incremental auto_vacuum and free its pages."""
+        self._fill()
+        self.conn.execute('DELETE FROM asset')
+        self.assertGreater(incremental_vacuum(self.path, convert=True), 0)
+        self.assertEqual(self._pragma('auto_vacuum'), 2)
+        self.assertEqual(self.conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
+        self.assertEqual(metrics.get('maintenance.incremental_vacuum.conversions'), 1)
+        self.assertEqual(incremental_vacuum(self.path, convert=True), 0)
+        self.assertEqual(metrics.get('maintenance.incremental_vacuum.conversions'), 1)
+
+    def test_wal_checkpoint(self):
+        """Checkpoints should only have work to do in wal mode."""
+        self._fill(10)
+        self.assertEqual(wal_checkpoint(self.path), -1)
+        self.conn.execute('PRAGMA journal_mode = wal')
+        self.conn.execute("INSERT INTO asset (asset_name) VALUES ('hello')")
+        self.assertGreaterEqual(wal_checkpoint(self.path), 0)
+
+    def test_scheduler_runs_due_tasks(self):
+        """Tasks should run once their interval has passed, and their durations should be recorded."""
+        self._fill(10)
+        clock = FakeClock()
+        scheduler = MaintenanceScheduler(self.path, {'analyze': 60, 'wal_checkpoint': 10, 'incremental_vacuum': None},
+                                         clock=clock)
+        scheduler.run_pending()
+        self.assertEqual(metrics.snapshot(), {})
+
+        clock.now += 10
+        scheduler.run_pending()
+        self.assertEqual(metrics.get('maintenance.wal_checkpoint.runs'), 1)
+        self.assertEqual(metrics.get('maintenance.analyze.runs'), 0)
+
+        clock.now += 50
+        scheduler.run_pending()
+        self.assertEqual(metrics.get('maintenance.wal_checkpoint.runs'), 2)
+        self.assertEqual(metrics.get('maintenance.analyze.runs'), 1)
+        self.assertEqual(metrics.summary('maintenance.analyze.duration')['count'], 1)
+        self.assertIsNone(metrics.summary('maintenance.incremental_vacuum.duration'))
+
+    @unittest.skipUnless(ONLINE_BACKUP, 'online backups need Python 3.7 or later')
+    def test_scheduler_backup(self):
+        """Backups should only be scheduled when there is somewhere to put them."""
+        self._fill(10)
+        self.assertNotIn('backup', MaintenanceScheduler(self.path, {'backup': 60}).intervals)
+        target_path = os.path.join(self.tmp_dir, 'backup.db')
+        scheduler = MaintenanceScheduler(self.path, {'backup': 60}, backup_path=target_path)
+        scheduler.run_task('backup')
+        self.assertTrue(os.path.exists(target_path))
+        self.assertEqual(metrics.get('maintenance.backup.runs'), 1)
+
+    @unittest.skipUnless(ONLINE_BACKUP, 'online backups need Python 3.7 or later')
+    def test_scheduler_converts_existing_databases(self):
+        """Scheduled incremental vacuums should convert databases created without incremental auto_vacuum."""
+        self._fill(10)
+        MaintenanceScheduler(self.path, {'incremental_vacuum': 60}).run_task('incremental_vacuum')
+        self.assertEqual(self._pragma('auto_vacuum'), 2)
+        self.assertEqual(metrics.get('maintenance.incremental_vacuum.runs'), 1)
+
+    def test_scheduler_skips_backup_without_online_backup(self):
+        """Without sqlite3's online backup api, backups should be refused and counted as skipped."""
+        self._fill(10)
+        target_path = os.path.join(self.tmp_dir, 'backup.db')
+        maintenance.ONLINE_BACKUP = False
+        try:
+            with self.assertRaises(BackupError):
+                backup_database(self.path, target_path)
+            MaintenanceScheduler(self.path, {'backup': 60}, backup_path=target_path).run_task('backup')
+        finally:
+            maintenance.ONLINE_BACKUP = ONLINE_BACKUP
+        self.assertFalse(os.path.exists(target_path))
+        self.assertEqual(metrics.get('maintenance.backup.skipped'), 1)
+        self.assertEqual(metrics.get('maintenance.backup.runs'), 0)
+        self.assertEqual(metrics.get('maintenance.backup.errors'), 0)
+
+    def test_scheduler_maintains_partitions(self):
+        """Partitions should be maintained and backed up along with the default database."""
+        self._fill(10)
+        partition_path = os.path.join(self.tmp_dir, 'asset_store.satellite.db')
+        partition = sqlite3.connect(partition_path)
+        partition.execute('CREATE TABLE asset (id INTEGER PRIMARY KEY, asset_name VARCHAR(64))')
+        partition.close()
+        target_path = os.path.join(self.tmp_dir, 'backup.db')
+        scheduler = MaintenanceScheduler(self.path, {'backup': 60}, backup_path=target_path,
+                                         partitions={'satellite': partition_path})
+        scheduler.run_task('backup')
+        scheduler.run_task('analyze')
+        self.assertTrue(os.path.exists(target_path))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'backup.satellite.db')))
+        self.assertEqual(metrics.get('maintenance.analyze.runs'), 1)
+        self.assertEqual(metrics.summary('maintenance.database_bytes')['last'],
+                         os.path.getsize(self.path) + os.path.getsize(partition_path))
+
+    def test_request_latency(self):
+        """Request latencies should be observed, and separately while maintenance is running."""
+        scheduler = MaintenanceScheduler(self.path, {})
+        app = Flask(__name__)
+
+        @app.route('/')
+        def index():
+            return 'ok'
+
+        scheduler.init_app(app)
+        client = app.test_client()
+        client.get('/')
+        self.assertEqual(metrics.summary('request.latency')['count'], 1)
+        self.assertIsNone(metrics.summary('request.latency.during_maintenance'))
+
+        scheduler._active = 1
+        client.get('/')
+        self.assertEqual(metrics.summary('request.latency')['count'], 2)
+        self.assertEqual(metrics.summary('request.latency.during_maintenance')['count'], 1)
+        scheduler.stop()
+
+    def test_one_process_runs_tasks(self):
+        """Only the scheduler holding the lock should run tasks, and others should see when one is running."""
+        self._fill(10)
+        lock_path = self.path + '.maintenance.lock'
+        clock = FakeClock()
+        leader = MaintenanceScheduler(self.path, {'analyze': 60}, lock_path=lock_path, clock=clock)
+        follower = MaintenanceScheduler(self.path, {'analyze': 60}, lock_path=lock_path, clock=clock)
+        seen_active = []
+        follower.tasks['analyze'] = lambda: seen_active.append(leader.active)
+        leader.tasks['analyze'] = lambda: seen_active.append(follower.active)
+        self.assertTrue(leader.elect())
+
+        clock.now += 60
+        follower.run_pending()
+        leader.run_pending()
+        self.assertEqual(seen_active, [True])
+        self.assertEqual(metrics.get('maintenance.analyze.runs'), 1)
+        self.assertFalse(follower.active)
+
+        # when the leader goes away, another scheduler takes over
+        leader.stop()
+        clock.now += 60
+        follower.run_pending()
+        self.assertEqual(metrics.get('maintenance.analyze.runs'), 2)
+        follower.stop()
@@ -0,0 +1,169 @@
+"""Partitioning Tests."""
+import json
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import create_engine
+
+from run import app, db
+from asset_store.models import Asset, AssetNameClaim
+from asset_store.partitioning import BY_ASSET_TYPE, BY_HASH, move_assets_to_partitions, PartitionedStore
+from .test_utils import AppTestCase, VALID_ASSET_DICTS
+
+
+def _sorted_by_name(asset_dicts):
+    return sorted(asset_dicts, key=lambda d: d['asset_name'])
+
+
+class PartitionedStoreTests(object):
+    """Tests shared by every way of partitioning assets."""
+
+    key = None
+    partition_names = []
+
+    def setUp(self):
+        """Partition assets across temporary sqlite files."""
+        super(PartitionedStoreTests, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.uris = dict((name, 'sqlite:///' + os.path.join(self.tmp_dir, name + '.db'))
+                         for name in self.partition_names)
+        self.store = PartitionedStore([(name, self.uris[name]) for name in self.partition_names], key=self.key)
+        app.extensions['partitions'] = self.store
+
+    def tearDown(self):
+        """Stop partitioning and remove the partition files."""
+        del app.extensions['partitions']
+        for engine in self.store.engines.values():
+            engine.dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def _names_in(self, partition):
+        engine = create_engine(self.uris[partition])
+        try:
+            return sorted(row[0] for row in engine.execute('SELECT asset_name FROM asset'))
+        finally:
+            engine.dispose()
+
+    def _create_all(self):
+        for asset_dict in VALID_ASSET_DICTS:
+            Asset.create_asset(**asset_dict)
+
+    def _post(self, asset_dict):
+        return self.app.post('/assets', headers={'X-User': 'admin'}, data=json.dumps(asset_dict),
+                             content_type='application/json')
+
+    def test_get_asset(self):
+        """Single assets should be found in their partition."""
+        self._create_all()
+        for asset_dict in VALID_ASSET_DICTS:
+            response = self.app.get('/assets/{}'.format(asset_dict['asset_name']))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.get_data()), asset_dict)
+        self.assertEqual(self.app.get('/assets/nope-not-here').status_code, 404)
+
+    def test_list_merges_partitions(self):
+        """Listings should include every partition, in asset_name order, and respect filters."""
+        self._create_all()
+        response = self.app.get('/assets')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data()), _sorted_by_name(VALID_ASSET_DICTS))
+
+        for query, field, value in (('asset_class=dish', 'asset_class', 'dish'),
+                                    ('asset_type=satellite', 'asset_type', 'satellite')):
+            response = self.app.get('/assets?{}'.format(query))
+            expected = _sorted_by_name(d for d in VALID_ASSET_DICTS if d[field] == value)
+            self.assertEqual(json.loads(response.get_data()), expected)
+
+    def test_missing_documents_are_rendered(self):
+        """Assets without a stored document should still be served in full."""
+        self._create_all()
+        for engine in self.store.engines.values():
+            engine.execute('UPDATE asset SET asset_json = NULL')
+        self.assertEqual(json.loads(self.app.get('/assets').get_data()), _sorted_by_name(VALID_ASSET_DICTS))
+        asset_dict = VALID_ASSET_DICTS[0]
+        self.assertEqual(json.loads(self.app.get('/assets/{}'.format(asset_dict['asset_name'])).get_data()),
+                         asset_dict)
+
+    def test_name_conflict(self):
+        """An asset_name that is already used should conflict, whatever the new asset's type."""
+        Asset.create_asset(asset_name='shared-name', asset_type='satellite', asset_class='dove')
+        response = self._post({'asset_name': 'shared-name', 'asset_type': 'antenna', 'asset_class': 'dish'})
+        self.assertEqual(response.status_code, 409)
+        stored = [name for partition in self.partition_names for name in self._names_in(partition)]
+        self.assertEqual(stored, ['shared-name'])
+
+    def test_update_details(self):
+        """Details updates should be written to the asset's partition."""
+        asset_dict = [d for d in VALID_ASSET_DICTS if d['asset_class'] == Asset.YAGI][0]
+        Asset.create_asset(**asset_dict)
+        path = '/assets/{}/details'.format(asset_dict['asset_name'])
+        response = self.app.put(path, data={'gain': '7.5'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(self.app.get(path).get_data()), {'gain': '7.5'})
+        document = json.loads(self.app.get('/assets/{}'.format(asset_dict['asset_name'])).get_data())
+        self.assertEqual(document['asset_details'], {'gain': '7.5'})
+
+    def test_move_existing_assets(self):
+        """Assets stored before partitioning was turned on should be moved into their partitions."""
+        del app.extensions['partitions']
+        self._create_all()
+        app.extensions['partitions'] = self.store
+        with app.app_context():
+            moved = move_assets_to_partitions(self.store, db.session, batch_size=3)
+            self.assertEqual(sorted(moved), sorted(d['asset_name'] for d in VALID_ASSET_DICTS))
+            self.assertEqual(db.session.query(Asset).count(), 0)
+            self.assertEqual(move_assets_to_partitions(self.store, db.session), [])
+        self.assertEqual(json.loads(self.app.get('/assets').get_data()), _sorted_by_name(VALID_ASSET_DICTS))
+        asset_dict = VALID_ASSET_DICTS[0]
+        self.assertEqual(json.loads(self.app.get('/assets/{}'.format(asset_dict['asset_name'])).get_data()),
+                         asset_dict)
+        self.assertEqual(self._post(asset_dict).status_code, 409)
+
+
+class AssetTypePartitionTestCase(PartitionedStoreTests, AppTestCase):
+    """Tests for assets partitioned by asset_type."""
+
+    key = BY_ASSET_TYPE
+    partition_names = ['satellite', 'antenna']
+
+    def test_assets_are_routed_by_type(self):
+        """Each asset should be stored only in its type's partition."""
+        self._create_all()
+        for partition in self.partition_names:
+            expected = sorted(d['asset_name'] for d in VALID_ASSET_DICTS if d['asset_type'] == partition)
+            self.assertEqual(self._names_in(partition), expected)
+
+    def test_every_type_needs_a_partition(self):
+        """Partitioning by asset_type without a partition for every type should be refused."""
+        with self.assertRaises(ValueError):
+            PartitionedStore([('satellite', self.uris['satellite'])], key=BY_ASSET_TYPE)
+
+    def test_failed_create_releases_claim(self):
+        """A create that fails in its partition should not leave the name claimed."""
+        engine = create_engine(self.uris['antenna'])
+        engine.execute("INSERT INTO asset (asset_name, asset_type, asset_class, asset_details_json) "
+                       "VALUES ('unclaimed', 'antenna', 'dish', '{}')")
+        engine.dispose()
+        response = self._post({'asset_name': 'unclaimed', 'asset_type': 'antenna', 'asset_class': 'dish'})
+        self.assertEqual(response.status_code, 409)
+        with app.app_context():
+            self.assertEqual(db.session.query(AssetNameClaim).count(), 0)
+
+
+class HashPartitionTestCase(PartitionedStoreTests, AppTestCase):
+    """Tests for assets partitioned by a hash of asset_name."""
+
+    key = BY_HASH
+    partition_names = ['p0', 'p1', 'p2']
+
+    def test_assets_are_routed_by_hash(self):
+        """Each asset should be stored only in the partition its name hashes to."""
+        self._create_all()
+        stored = [name for partition in self.partition_names for name in self._names_in(partition)]
+        self.assertEqual(sorted(stored), sorted(d['asset_name'] for d in VALID_ASSET_DICTS))
+        for asset_dict in VALID_ASSET_DICTS:
+            partition = self.store.partition_for(asset_dict['asset_name'], asset_dict['asset_type'])
+            self.assertIn(asset_dict['asset_name'], self._names_in(partition))
+        with app.app_context():
+            self.assertEqual(db.session.query(AssetNameClaim).count(), 0)
@@ -0,0 +1,194 @@
+"""Shared Cache Tests."""
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from asset_store import models
+from asset_store.metrics import metrics
+from asset_store.models import Asset, register_write_listener
+from asset_store.shared_cache import CacheServer, CacheStore, SharedCacheClient
+from run import app
+from .test_utils import AppTestCase, VALID_ASSET_DICTS
+
+
+def worker(address, operation, key, value, results):
+    """Act as a separate worker process using the shared cache."""
+    client = SharedCacheClient(address)
+    if operation == 'fill':
+        version, _ = client.get(key)
+        results.put(client.set(key, version, value))
+    elif operation == 'get':
+        results.put(client.get(key)[1])
+    elif operation == 'invalidate':
+        client.invalidate(key)
+        results.put(True)
+
+
+class CacheStoreTestCase(unittest.TestCase):
+    """Tests for the LRU store held by the cache server."""
+
+    def test_get_and_set(self):
+        """A stored value should be returned until it is invalidated."""
+        store = CacheStore(1024)
+        version, value = store.get('hello')
+        self.assertIsNone(value)
+        self.assertTrue(store.set('hello', version, '{"a": 1}'))
+        self.assertEqual(store.get('hello'), (version, '{"a": 1}'))
+        store.invalidate('hello')
+        self.assertEqual(store.get('hello'), (version + 1, None))
+
+    def test_stale_version_is_rejected(self):
+        """A value read before an invalidation should not be stored after it."""
+        store = CacheStore(1024)
+        version, _ = store.get('hello')
+        store.invalidate('hello')
+        self.assertFalse(store.set('hello', version, 'stale'))
+        self.assertIsNone(store.get('hello')[1])
+
+    def test_lru_eviction(self):
+        """The least recently used entries should be evicted to stay within max_bytes."""
+        store = CacheStore(30)
+        for key in ('aaaa', 'bbbb', 'cccc'):
+            store.set(key, 0, 'x' * 6)
+        store.get('aaaa')
+        store.set('dddd', 0, 'x' * 6)
+        self.assertIsNone(store.get('bbbb')[1])
+        self.assertIsNotNone(store.get('aaaa')[1])
+        self.assertEqual(store.stats(), {'entries': 3, 'bytes': 30})
+
+    def test_too_large(self):
+        """Values that can never fit should not be stored."""
+        store = CacheStore(10)
+        self.assertFalse(store.set('hello', 0, 'x' * 10))
+        self.assertEqual(store.stats(), {'entries': 0, 'bytes': 0})
+
+    def test_ttl(self):
+        """Expired entries should miss."""
+        store = CacheStore(1024, ttl=-1)
+        store.set('hello', 0, 'world')
+        self.assertIsNone(store.get('hello')[1])
+        self.assertEqual(store.stats()['bytes'], 0)
+
+    def test_invalidations_are_bounded(self):
+        """Invalidation records should count against max_bytes, and forgetting one should reject older fills."""
+        store = CacheStore(100)
+        version, _ = store.get('hello')
+        for i in range(1000):
+            store.invalidate('asset-{:04d}'.format(i))
+        self.assertLessEqual(store.stats()['bytes'], 100)
+        # the invalidations that could have covered hello were forgotten, so its old fill can't be trusted
+        self.assertFalse(store.set('hello', version, 'stale'))
+        version, _ = store.get('hello')
+        self.assertTrue(store.set('hello', version, 'fresh'))
+
+
+class SharedCacheTestCase(unittest.TestCase):
+    """Tests for sharing the cache between processes."""
+
+    def setUp(self):
+        """Start a cache server on a temporary socket."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.address = os.path.join(self.tmp_dir, 'cache.sock')
+        self.server = CacheServer(self.address, 1024 * 1024)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = SharedCacheClient(self.address)
+
+    def tearDown(self):
+        """Stop the cache server."""
+        self.server.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_worker(self, operation, key, value=None):
+        """Run an operation in a separate process and return its result."""
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=worker, args=(self.address, operation, key, value, results))
+        process.start()
+        result = results.get(timeout=10)
+        process.join(10)
+        return result
+
+    def test_hit_across_processes(self):
+        """A value cached by one worker should be a hit for every other worker."""
+        self.assertTrue(self.run_worker('fill', 'hello', '{"asset_name": "hello"}'))
+        self.assertEqual(self.client.get('hello')[1], '{"asset_name": "hello"}')
+        self.assertEqual(self.run_worker('get', 'hello'), '{"asset_name": "hello"}')
+
+    def test_invalidation_reaches_every_worker(self):
+        """An invalidation from one worker should be seen by every worker."""
+        version, _ = self.client.get('hello')
+        self.client.set('hello', version, 'world')
+        self.assertEqual(self.run_worker('get', 'hello'), 'world')
+
+        self.assertTrue(self.run_worker('invalidate', 'hello'))
+        self.assertIsNone(self.client.get('hello')[1])
+        self.assertIsNone(self.run_worker('get', 'hello'))
+        # a read that started before the invalidation can't store its stale value
+        self.assertFalse(self.client.set('hello', version, 'world'))
+
+    def test_bad_requests(self):
+        """Requests that aren't well formed json calls of a cache operation should get a null reply."""
+        for line in (b'not json\n',
+                     b'{"operation": "__init__", "args": [1]}\n',
+                     b'{"operation": "set", "args": ["hello", "0", "world"]}\n',
+                     b'{"operation": "get"}\n',
+                     b'\x80\x03cos\nsystem\n.\n'):
+            self.assertEqual(self.server.handle(line), b'null\n')
+        self.assertEqual(self.server.handle(b'{"operation": "stats", "args": []}\n'),
+                         b'{"entries": 0, "bytes": 0}\n')
+
+    def test_socket_is_private(self):
+        """Only the server's user should be able to connect."""
+        self.assertEqual(os.stat(self.address).st_mode & 0o777, 0o600)
+
+    def test_server_unavailable(self):
+        """A client that can't reach the server should just miss."""
+        client = SharedCacheClient(os.path.join(self.tmp_dir, 'nope.sock'))
+        self.assertEqual(client.get('hello'), (None, None))
+        self.assertFalse(client.set('hello', None, 'world'))
+        client.invalidate('hello')
+
+
+class SharedCacheAPITestCase(AppTestCase):
+    """Reading assets through the shared cache."""
+
+    def setUp(self):
+        """Serve a shared cache and point the app at it."""
+        super(SharedCacheAPITestCase, self).setUp()
+        metrics.reset()
+        self.tmp_dir = tempfile.mkdtemp()
+        address = os.path.join(self.tmp_dir, 'cache.sock')
+        self.server = CacheServer(address, 1024 * 1024)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = SharedCacheClient(address)
+        register_write_listener(self.client.invalidate)
+        app.extensions['shared_cache'] = self.client
+
+    def tearDown(self):
+        """Stop using the shared cache."""
+        del app.extensions['shared_cache']
+        models._write_listeners.remove(self.client.invalidate)
+        self.server.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_asset_through_cache(self):
+        """Repeated reads should hit the cache, and writes should invalidate it."""
+        asset_dict = [d for d in VALID_ASSET_DICTS if d['asset_class'] == Asset.YAGI][0]
+        Asset.create_asset(**asset_dict)
+        path = '/assets/{}'.format(asset_dict['asset_name'])
+        self.app.get(path)
+        response = self.app.get(path)
+        self.assertEqual(json.loads(response.get_data()), asset_dict)
+        self.assertEqual(metrics.get('shared_cache.hits'), 1)
+
+        self.app.put('{}/details'.format(path), data={'gain': '2.79'})
+        response = self.app.get(path)
+        self.assertEqual(json.loads(response.get_data())['asset_details'], {'gain': '2.79'})
+        self.assertEqual(metrics.get('shared_cache.hits'), 1)
@@ -41,6 +41,16 @@ for asset_type_choice in Asset.ASSET_TYPES:
                                       'asset_details': details})
 
 
+class FakeClock(object):
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
 # a testing base class with a custom setUp
 class AppTestCase(unittest.TestCase):
     """Custom base class to configure app with a test database."""
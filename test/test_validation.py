@@ -0,0 +1,66 @@
+"""Validation Tests."""
+import ddt
+import unittest
+
+from asset_store.models import asset_validator
+from asset_store.utils import ValidationError
+from .test_utils import VALID_ASSET_DICTS
+
+
+INVALID_ASSETS = [
+    ({'asset_name': 11235, 'asset_type': 'antenna', 'asset_class': 'dish'},
+     'asset_name must be a string.'),
+    ({'asset_name': 'abc', 'asset_type': 'antenna', 'asset_class': 'dish'},
+     'asset_name must be at least 4 characters in length.'),
+    ({'asset_name': 'a' * 65, 'asset_type': 'antenna', 'asset_class': 'dish'},
+     'asset_name must be at most 64 characters in length.'),
+    ({'asset_name': '_hello', 'asset_type': 'antenna', 'asset_class': 'dish'},
+     'asset_name cannot begin with an underscore or dash.'),
+    ({'asset_name': 'hello world', 'asset_type': 'antenna', 'asset_class': 'dish'},
+     'asset_name may only contain alphanumeric ascii characters, underscores, and dashes.'),
+    ({'asset_name': 'hello', 'asset_type': 2.2, 'asset_class': 'dish'},
+     'asset_type must be a string.'),
+    ({'asset_name': 'hello', 'asset_type': 'debris', 'asset_class': 'dish'},
+     "debris is not a valid choice for asset_type. Valid choices are: ['satellite', 'antenna']"),
+    ({'asset_name': 'hello', 'asset_type': 'antenna', 'asset_class': 'pigeon'},
+     "pigeon is not a valid choice for asset_class. Valid choices are: ['dish', 'yagi', 'dove', 'rapideye']"),
+    ({'asset_name': 'hello', 'asset_type': 'antenna', 'asset_class': 'dove'},
+     "Invalid asset_class. For the antenna asset_type, valid asset_class values are: ['dish', 'yagi']"),
+    ({'asset_name': 'hello', 'asset_type': 'satellite', 'asset_class': 'yagi'},
+     "Invalid asset_class. For the satellite asset_type, valid asset_class values are: ['dove', 'rapideye']"),
+    ({'asset_name': 'hello', 'asset_type': 'antenna', 'asset_class': 'dish', 'asset_details': {'gain': 1.0}},
+     "key gain in asset_details is not supported for asset_class dish. allowed keys are: ['diameter', 'radome']"),
+    ({'asset_name': 'hello', 'asset_type': 'satellite', 'asset_class': 'dove', 'asset_details': {'gain': 1.0}},
+     'key gain in asset_details is not supported for asset_class dove. allowed keys are: []'),
+    ({'asset_name': 'hello', 'asset_type': 'antenna', 'asset_class': 'yagi', 'asset_details': {'gain': 'loud'}},
+     'gain in asset_details should have a float value'),
+    ({'asset_name': 'hello', 'asset_type': 'antenna', 'asset_class': 'dish', 'asset_details': {'diameter': None}},
+     'diameter in asset_details should have a float value'),
+]
+
+
+@ddt.ddt
+class AssetValidatorTestCase(unittest.TestCase):
+    """Tests for the compiled asset validator."""
+
+    @ddt.data(*VALID_ASSET_DICTS)
+    def test_validate_asset__valid(self, asset_dict):
+        """Valid assets should pass."""
+        self.assertTrue(asset_validator.validate_asset(**asset_dict))
+
+    @ddt.data(*INVALID_ASSETS)
+    @ddt.unpack
+    def test_validate_asset__invalid(self, asset_dict, expected_message):
+        """Invalid assets should raise the same ValidationError messages as the Asset model."""
+        with self.assertRaises(ValidationError) as context:
+            asset_validator.validate_asset(**asset_dict)
+        self.assertEqual('{}'.format(context.exception), expected_message)
+
+    def test_validate_batch(self):
+        """A batch should be validated in one pass, with an error (or None) per asset."""
+        assets = [VALID_ASSET_DICTS[0]] + [asset_dict for asset_dict, _ in INVALID_ASSETS] + [VALID_ASSET_DICTS[1]]
+        errors = asset_validator.validate_batch(assets)
+        self.assertEqual(len(errors), len(assets))
+        self.assertIsNone(errors[0])
+        self.assertIsNone(errors[-1])
+        self.assertEqual(['{}'.format(err) for err in errors[1:-1]], [message for _, message in INVALID_ASSETS])
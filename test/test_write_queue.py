@@ -0,0 +1,139 @@
+"""Group Commit Tests."""
+import json
+import threading
+
+from run import app, db
+from asset_store import models
+from asset_store.metrics import metrics
+from asset_store.models import Asset, register_write_listener
+from asset_store.utils import ResourceConflictError, ValidationError, WriteTimeoutError
+from asset_store.write_queue import _PendingWrite, GroupCommitQueue, get_write_queue
+from .test_utils import AppTestCase, VALID_ASSET_DICTS
+
+
+class GroupCommitTestCase(AppTestCase):
+    """Tests for writing assets through the group commit queue."""
+
+    def setUp(self):
+        """Route writes through a group commit queue with a generous batching window."""
+        super(GroupCommitTestCase, self).setUp()
+        metrics.reset()
+        self.write_queue = GroupCommitQueue(app, db, interval=0.05)
+        self.write_queue.start()
+        app.extensions['group_commit'] = self.write_queue
+
+    def tearDown(self):
+        """Go back to committing per request."""
+        del app.extensions['group_commit']
+        self.write_queue.stop()
+
+    def _create_concurrently(self, asset_dicts):
+        """Create assets from one thread each, returning a list of (asset_dict, error) pairs."""
+        outcomes = []
+
+        def create(asset_dict):
+            try:
+                Asset.create_asset(**asset_dict)
+                outcomes.append((asset_dict, None))
+            except (ValidationError, ResourceConflictError) as err:
+                outcomes.append((asset_dict, err))
+
+        threads = [threading.Thread(target=create, args=(asset_dict,)) for asset_dict in asset_dicts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_get_write_queue(self):
+        """The queue installed on the app should be used for writes."""
+        self.assertIs(get_write_queue(app), self.write_queue)
+
+    def test_concurrent_creates_are_batched(self):
+        """Concurrent creates should all be committed, sharing transactions."""
+        outcomes = self._create_concurrently(VALID_ASSET_DICTS)
+        self.assertEqual([err for _, err in outcomes], [None] * len(VALID_ASSET_DICTS))
+        with app.app_context():
+            names = set(name for name, in db.session.query(Asset.asset_name))
+        self.assertEqual(names, set(asset_dict['asset_name'] for asset_dict in VALID_ASSET_DICTS))
+        self.assertEqual(metrics.get('group_commit.writes'), len(VALID_ASSET_DICTS))
+        self.assertLess(metrics.get('group_commit.batches'), len(VALID_ASSET_DICTS))
+
+    def test_name_conflict_only_fails_its_own_write(self):
+        """A duplicate name in a batch should fail that write alone."""
+        Asset.create_asset(**VALID_ASSET_DICTS[0])
+        outcomes = self._create_concurrently(VALID_ASSET_DICTS[:3])
+        errors = dict((asset_dict['asset_name'], err) for asset_dict, err in outcomes)
+        self.assertIsInstance(errors[VALID_ASSET_DICTS[0]['asset_name']], ResourceConflictError)
+        self.assertIsNone(errors[VALID_ASSET_DICTS[1]['asset_name']])
+        self.assertIsNone(errors[VALID_ASSET_DICTS[2]['asset_name']])
+
+    def test_validation_errors_are_raised_to_the_caller(self):
+        """Invalid writes should be rejected before they reach the queue."""
+        asset_dict = dict(VALID_ASSET_DICTS[0], asset_name='-nope')
+        with self.assertRaises(ValidationError):
+            Asset.create_asset(**asset_dict)
+        self.assertEqual(metrics.get('group_commit.writes'), 0)
+
+    def test_update_details(self):
+        """Details updates through the api should be committed by the writer."""
+        asset_dict = [d for d in VALID_ASSET_DICTS if d['asset_class'] == Asset.YAGI][0]
+        Asset.create_asset(**asset_dict)
+        path = '/assets/{}/details'.format(asset_dict['asset_name'])
+        response = self.app.put(path, data={'gain': '2.79'})
+        self.assertEqual(response.status_code, 201)
+        response = self.app.get(path)
+        self.assertEqual(json.loads(response.get_data()), {'gain': '2.79'})
+        self.assertEqual(metrics.get('group_commit.writes'), 2)
+
+    def test_writer_starts_lazily(self):
+        """A queue that was never started (or was inherited from a parent process) should start its own writer."""
+        write_queue = GroupCommitQueue(app, db)
+        try:
+            self.assertEqual(write_queue.submit(lambda session: 'committed'), 'committed')
+            parent_thread = write_queue._thread
+            # pretend the queue was created before a fork
+            write_queue._pid = -1
+            self.assertEqual(write_queue.submit(lambda session: 'committed again'), 'committed again')
+            self.assertIsNot(write_queue._thread, parent_thread)
+        finally:
+            write_queue.stop()
+
+    def test_submit_times_out(self):
+        """Callers should stop waiting for a write that takes longer than the timeout."""
+        write_queue = GroupCommitQueue(app, db, timeout=0.01)
+        release = threading.Event()
+        try:
+            with self.assertRaises(WriteTimeoutError):
+                write_queue.submit(lambda session: release.wait(5))
+            self.assertEqual(metrics.get('group_commit.timeouts'), 1)
+        finally:
+            release.set()
+            write_queue.stop()
+
+    def test_late_commit_notifies_listeners(self):
+        """A write committed after its caller timed out should still invalidate cached reads of the asset."""
+        asset_dict = [d for d in VALID_ASSET_DICTS if d['asset_class'] == Asset.YAGI][0]
+        Asset.create_asset(**asset_dict)
+        notified = []
+        register_write_listener(notified.append)
+        release = threading.Event()
+        slow_queue = GroupCommitQueue(app, db, timeout=0.01)
+        app.extensions['group_commit'] = slow_queue
+        try:
+            # hold the writer up so that the details update is committed after its caller gives up
+            slow_queue.start()
+            slow_queue._queue.put(_PendingWrite(lambda session: release.wait(5)))
+            with app.test_request_context():
+                asset = db.session.query(Asset).filter(Asset.asset_name == asset_dict['asset_name']).one()
+                with self.assertRaises(WriteTimeoutError):
+                    asset.update_details({'gain': 4.0})
+            self.assertEqual(notified, [])
+            release.set()
+            slow_queue.stop()
+            self.assertEqual(notified, [asset_dict['asset_name']])
+        finally:
+            release.set()
+            slow_queue.stop()
+            app.extensions['group_commit'] = self.write_queue
+            models._write_listeners.remove(notified.append)